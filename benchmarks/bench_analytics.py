@@ -0,0 +1,287 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from synthetic_data import SyntheticGovernance
+
+code_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+baselines_dir = os.path.join(os.path.dirname(__file__), 'baselines')
+
+scales = ['1e4', '1e5', '1e6']
+
+# Parsed event streams and the dataset files they are persisted to
+datasets = {'VoteCast': 'votes_df', 'ProposalCreated': 'proposal_created_df',
+            'ProposalCanceled': 'proposal_cancelled_df', 'ProposalQueued': 'proposals_queued_df',
+            'ProposalExecuted': 'proposal_executed_df', 'Transfer': 'transfer_df',
+            'DelegateVotesChanged': 'delegatevoteschanged_df', 'DelegateChanged': 'delegatechanged_df'}
+
+# Higher is better for the throughput metrics, lower for the others
+higher_is_better = {'rows_per_sec'}
+compared_metrics = ['rows_per_sec', 'peak_rss_mb']
+# Stages faster than this, or memory peaks smaller than this, are too
+# noisy to be compared
+min_seconds = 0.05
+min_rss_mb = 10
+
+
+def get_rss():
+    # Resident memory of this process in bytes
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class MemorySampler:
+    # Peak resident memory above the level at the start of a stage, sampled
+    # from a background thread since ru_maxrss never goes down between stages.
+    # Memory freed by an earlier stage and reused is not counted.
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.running = False
+        self.start_rss = 0
+        self.peak_rss = 0
+
+    def sample(self):
+        while self.running:
+            self.peak_rss = max(self.peak_rss, get_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = get_rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, get_rss())
+
+    def get_peak_mb(self):
+        return (self.peak_rss - self.start_rss) / 2**20
+
+
+class StageTimer:
+    # Times the stages of one run and keeps their metrics in order
+
+    def __init__(self):
+        self.results = dict()
+
+    def run(self, stage, func, *args, n_rows=None, **kwargs):
+        # n_rows defaults to the number of rows of the returned dataframes
+        with MemorySampler() as sampler:
+            start = time.perf_counter()
+            value = func(*args, **kwargs)
+            seconds = time.perf_counter() - start
+        if n_rows is None:
+            n_rows = get_n_rows(value)
+        self.add(stage, seconds, n_rows, sampler.get_peak_mb())
+        return value
+
+    def add(self, stage, seconds, n_rows, peak_mb):
+        self.results[stage] = {
+            'n_rows': n_rows,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(n_rows / seconds, 1) if seconds > 0 else None,
+            'peak_rss_mb': round(peak_mb, 1)}
+
+
+def get_n_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(get_n_rows(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(get_n_rows(item) for item in value)
+    return 0
+
+
+def parse_stream(timer, synthetic, event_name):
+    # Generation is not timed, only the parsing of each chunk and the final
+    # concatenation, the way the partitions of pipeline.py are parsed
+    from utils import get_event_parser
+    parser = get_event_parser(event_name)
+    dfs = list()
+    seconds = 0
+    with MemorySampler() as sampler:
+        for events in synthetic.get_events(event_name):
+            start = time.perf_counter()
+            dfs.append(parser(events))
+            seconds += time.perf_counter() - start
+            del events
+        start = time.perf_counter()
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+        seconds += time.perf_counter() - start
+        del dfs
+    timer.add('parse_' + event_name, seconds, len(df), sampler.get_peak_mb())
+    return df
+
+
+def run_stages(n_events, chunk_size, seed, skip, result_queue):
+    # Runs in a fresh process, so the memory of one scale does not leak into
+    # the next one
+    os.environ['TQDM_DISABLE'] = '1'
+    sys.path.append(code_dir)
+    from download import convert_to_pickle
+    from utils import (get_proposal_titles, get_supporters, get_votes_weighted, load_dataframes,
+                       merge_block_timestamps, persist_dataframe)
+
+    timer = StageTimer()
+    synthetic = SyntheticGovernance(
+        n_events, seed=seed, chunk_size=chunk_size)
+    blocks_df = synthetic.get_blocks_df()
+
+    # Parsing
+    dfs = {filename: parse_stream(timer, synthetic, event_name)
+           for event_name, filename in datasets.items()}
+
+    # Persisting and loading, first from the CSV files and then from the
+    # pickles written by download.py --convert
+    if 'load' not in skip:
+        n_rows = get_n_rows(dfs)
+        path_dir = tempfile.mkdtemp(prefix='bench_analytics_')
+        try:
+            timer.run('persist_dataframe', lambda: [persist_dataframe(path_dir, df, filename + '.csv.gz')
+                                                    for filename, df in dfs.items()], n_rows=n_rows)
+            timer.run('load_dataframes_csv', load_dataframes, path_dir + '/')
+            timer.run('convert_to_pickle', lambda: [convert_to_pickle(os.path.join(path_dir, filename + '.csv.gz'))
+                                                    for filename in dfs], n_rows=n_rows)
+            timer.run('load_dataframes_pickle',
+                      load_dataframes, path_dir + '/')
+        finally:
+            shutil.rmtree(path_dir)
+
+    # Enrichment and aggregations of the 02 notebook
+    votes_df = dfs['votes_df']
+    timer.run('merge_block_timestamps_votes',
+              merge_block_timestamps, votes_df, blocks_df)
+    timer.run('merge_block_timestamps_transfers',
+              merge_block_timestamps, dfs['transfer_df'], blocks_df)
+    proposal_created_df = timer.run(
+        'get_proposal_titles', get_proposal_titles, dfs['proposal_created_df'])
+    supporters_df = timer.run(
+        'get_supporters', get_supporters, votes_df, n_rows=len(votes_df))
+    timer.run('get_votes_weighted', get_votes_weighted, votes_df, supporters_df, proposal_created_df,
+              dfs['proposal_cancelled_df'], dfs['proposal_executed_df'], dfs['proposals_queued_df'],
+              blocks_df, n_rows=len(votes_df))
+
+    # CDFs of the EDA notebooks
+    if 'plot' not in skip:
+        from plot_utils import plot_cdf
+        votes_per_voter = timer.run('votes_per_voter', lambda: votes_df.groupby('voter').size(),
+                                    n_rows=len(votes_df))
+        timer.run('plot_cdf_votes_per_voter', plot_cdf, votes_per_voter,
+                  xlog=True, n_rows=len(votes_per_voter))
+        timer.run('plot_cdf_transfer_amounts', plot_cdf, dfs['transfer_df']['amount'],
+                  xlog=True, n_rows=len(dfs['transfer_df']))
+
+    result_queue.put(timer.results)
+
+
+def run_scale(scale, chunk_size=100_000, seed=0, skip=()):
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=run_stages, args=(
+        int(float(scale)), chunk_size, seed, skip, result_queue))
+    process.start()
+    # Large scales produce large results, so read before joining
+    while True:
+        try:
+            results = result_queue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Run with {scale} events failed")
+    process.join()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # A metric regresses when it is worse than the baseline by more than tolerance
+    regressions = list()
+    for scale, stages in results.items():
+        for stage, metrics in stages.items():
+            old_metrics = baseline.get(scale, dict()).get(stage)
+            if old_metrics is None or max(old_metrics['seconds'], metrics['seconds']) < min_seconds:
+                continue
+            for metric in compared_metrics:
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                if metric == 'peak_rss_mb' and max(old, new) < min_rss_mb:
+                    continue
+                change = (new - old) / old
+                if metric in higher_is_better:
+                    change = -change
+                if change > tolerance:
+                    regressions.append((scale, stage, metric, old, new))
+    return regressions
+
+
+def print_results(results):
+    columns = ['n_rows', 'seconds', 'rows_per_sec', 'peak_rss_mb']
+    print('{:<8}{:<36}'.format('scale', 'stage') +
+          ''.join('{:>16}'.format(column) for column in columns))
+    for scale, stages in results.items():
+        for stage, metrics in stages.items():
+            print('{:<8}{:<36}'.format(scale, stage) + ''.join('{:>16}'.format(str(metrics[column]))
+                                                               for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark parsing, loading and aggregating synthetic governance datasets.')
+    parser.add_argument('--scales', nargs='*', default=scales,
+                        help='Number of events of each run, e.g., 1e4 1e6 1e8')
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip', nargs='*', default=[], choices=['load', 'plot'],
+                        help='Skip the persist/load or the plotting stages')
+    parser.add_argument('--baseline', default=os.path.join(baselines_dir, 'analytics.json'))
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative change that counts as a regression')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = dict()
+    for scale in args.scales:
+        print(f"Running {scale} events")
+        results[scale] = run_scale(
+            scale, chunk_size=args.chunk_size, seed=args.seed, skip=args.skip)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.save_baseline:
+        baseline = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for scale, stage, metric, old, new in regressions:
+            print(f"REGRESSION {scale} {stage} {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
@@ -0,0 +1,269 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+
+from mock_node import (MockNode, get_tx_hash, governor_abi, governor_address, pool_abi, pool_address,
+                       token_abi, token_address)
+
+code_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+baselines_dir = os.path.join(os.path.dirname(__file__), 'baselines')
+
+head = 20_563_000
+
+# Node profiles: a node next door, a remote archive node with a slow tail,
+# a rate-limited provider and a flaky one
+node_profiles = {
+    'local': {'latency': 0.002},
+    'remote': {'latency': 0.02, 'jitter': 0.02, 'tail_probability': 0.02, 'tail_latency': 0.5},
+    'rate-limited': {'latency': 0.005, 'rate_limit': 100},
+    'flaky': {'latency': 0.005, 'error_rate': 0.02},
+}
+
+# node_kwargs override the node profile and pool_kwargs are passed to RPCPool.
+# The rate-limited scenarios send more requests per second than the node
+# allows, and the remote pool scenarios hedge from the first request, since
+# they send fewer eth_getLogs requests than RPCPool needs to estimate a delay.
+scenarios = [
+    {'name': 'events-transfer-local-http', 'fetcher': 'get_events', 'event': 'Transfer',
+     'node': 'local', 'provider': 'http', 'n_blocks': 5_000, 'batch_size': 50, 'max_workers': 10},
+    {'name': 'events-transfer-local-batch500', 'fetcher': 'get_events', 'event': 'Transfer',
+     'node': 'local', 'provider': 'http', 'n_blocks': 5_000, 'batch_size': 500, 'max_workers': 10},
+    {'name': 'events-votecast-remote-http', 'fetcher': 'get_events', 'event': 'VoteCast',
+     'node': 'remote', 'provider': 'http', 'n_blocks': 20_000, 'batch_size': 1000, 'max_workers': 10},
+    {'name': 'events-votecast-remote-pool', 'fetcher': 'get_events', 'event': 'VoteCast',
+     'node': 'remote', 'provider': 'pool', 'n_nodes': 2, 'n_blocks': 20_000, 'batch_size': 1000, 'max_workers': 10,
+     'pool_kwargs': {'hedge_delay': 0.25}},
+    {'name': 'events-transfer-rate-limited-pool', 'fetcher': 'get_events', 'event': 'Transfer',
+     'node': 'rate-limited', 'node_kwargs': {'rate_limit': 5}, 'provider': 'pool', 'n_blocks': 5_000,
+     'batch_size': 50, 'max_workers': 5},
+    {'name': 'events-transfer-flaky-pool', 'fetcher': 'get_events', 'event': 'Transfer',
+     'node': 'flaky', 'provider': 'pool', 'n_blocks': 5_000, 'batch_size': 50, 'max_workers': 10},
+    {'name': 'blocks-local-http', 'fetcher': 'get_blocks', 'node': 'local', 'provider': 'http',
+     'n_blocks': 2_000, 'max_workers': 20},
+    {'name': 'blocks-remote-pool', 'fetcher': 'get_blocks', 'node': 'remote', 'provider': 'pool', 'n_nodes': 2,
+     'n_blocks': 1_000, 'max_workers': 20, 'pool_kwargs': {'hedge_min_samples': 5}},
+    {'name': 'blocks-rate-limited-pool', 'fetcher': 'get_blocks', 'node': 'rate-limited', 'provider': 'pool',
+     'n_blocks': 1_000, 'max_workers': 20},
+    {'name': 'transactions-local-http', 'fetcher': 'get_transactions', 'node': 'local', 'provider': 'http',
+     'n_txs': 1_000, 'max_workers': 20},
+    {'name': 'balances-local-http', 'fetcher': 'get_balances_per_block', 'node': 'local', 'provider': 'http',
+     'n_blocks': 1_000, 'max_workers': 20},
+    {'name': 'balances-rate-limited-pool', 'fetcher': 'get_balances_per_block', 'node': 'rate-limited',
+     'provider': 'pool', 'n_blocks': 150, 'max_workers': 20},
+]
+
+# Higher is better for the throughput metrics, lower for the others
+higher_is_better = {'requests_per_sec', 'items_per_sec'}
+compared_metrics = ['items_per_sec', 'p50_ms', 'p99_ms', 'peak_rss_mb']
+
+
+def get_timed_provider(base, rate_limit_error=None):
+    # Record the latency of every JSON-RPC request sent by web3. For RPCPool,
+    # pass its RateLimitError to also count the requests sent to the nodes
+    # (retries and hedges included) and the ones refused with a rate limit.
+    class TimedProvider(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.request_latencies = list()
+            self.n_sent = 0
+            self.n_rate_limited = 0
+            self.counts_lock = threading.Lock()
+
+        def make_request(self, method, params):
+            start = time.perf_counter()
+            try:
+                return super().make_request(method, params)
+            finally:
+                self.request_latencies.append(time.perf_counter() - start)
+
+        if rate_limit_error is not None:
+            def send(self, *args, **kwargs):
+                with self.counts_lock:
+                    self.n_sent += 1
+                try:
+                    return super().send(*args, **kwargs)
+                except rate_limit_error:
+                    with self.counts_lock:
+                        self.n_rate_limited += 1
+                    raise
+
+    return TimedProvider
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(int(percentile * len(values)), len(values) - 1)]
+
+
+def run_fetcher(scenario, urls, result_queue):
+    # Runs in a fresh process, so the peak memory belongs to this scenario only
+    os.environ['TQDM_DISABLE'] = '1'
+    sys.path.append(code_dir)
+    import requests
+    from web3 import Web3
+
+    from ethereum import get_balances_per_block, get_blocks, get_events, get_transactions
+    from rpc_pool import RateLimitError, RPCPool
+
+    max_workers = scenario['max_workers']
+    if scenario['provider'] == 'pool':
+        provider = get_timed_provider(RPCPool, rate_limit_error=RateLimitError)(
+            urls, max_concurrency=max_workers, timeout=10, **scenario.get('pool_kwargs', dict()))
+    else:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        provider = get_timed_provider(Web3.HTTPProvider)(
+            urls[0], session=session, request_kwargs={'timeout': 10})
+    w3 = Web3(provider)
+
+    fetcher = scenario['fetcher']
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if fetcher == 'get_events':
+        is_token = scenario['event'] in ('Transfer', 'DelegateVotesChanged')
+        contract = w3.eth.contract(address=token_address if is_token else governor_address,
+                                   abi=token_abi if is_token else governor_abi)
+        items = get_events(contract.events[scenario['event']], start_block=head - scenario['n_blocks'],
+                           end_block=head, batch_size=scenario['batch_size'], max_workers=max_workers)
+    elif fetcher == 'get_blocks':
+        items = get_blocks(w3, block_numbers=range(head - scenario['n_blocks'], head),
+                           max_workers=max_workers)
+    elif fetcher == 'get_transactions':
+        txs_hashes = [get_tx_hash(head - index // 10, index % 10)
+                      for index in range(scenario['n_txs'])]
+        items = get_transactions(w3, txs_hashes, max_workers=max_workers)
+    elif fetcher == 'get_balances_per_block':
+        caller = w3.eth.contract(address=pool_address, abi=pool_abi).caller
+        items = get_balances_per_block(caller, block_numbers=range(head - scenario['n_blocks'], head),
+                                       n_tokens=2, max_workers=max_workers)
+    else:
+        raise ValueError(f"Fetcher {fetcher} not recognized")
+    wall = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+
+    latencies = provider.request_latencies
+    result_queue.put({
+        'n_requests': len(latencies),
+        'n_sent': provider.n_sent or len(latencies),
+        'n_rate_limited': provider.n_rate_limited,
+        'n_items': len(items),
+        'wall_s': round(wall, 3),
+        'requests_per_sec': round(len(latencies) / wall, 1),
+        'items_per_sec': round(len(items) / wall, 1),
+        'p50_ms': round(1000 * get_percentile(latencies, .5), 2),
+        'p99_ms': round(1000 * get_percentile(latencies, .99), 2),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(peak_rss / 1024, 1)})
+
+
+def get_preload(scenario):
+    # Block ranges the scenario requests, built by the mock node at startup
+    fetcher = scenario['fetcher']
+    if fetcher == 'get_events':
+        return {'logs': (head - scenario['n_blocks'], head)}
+    if fetcher == 'get_blocks':
+        return {'blocks': (head - scenario['n_blocks'], head - 1)}
+    return dict()
+
+
+def run_scenario(scenario):
+    node_kwargs = dict(node_profiles[scenario['node']], **scenario.get('node_kwargs', dict()))
+    nodes = [MockNode(node_id=index, preload=get_preload(scenario), **node_kwargs)
+             for index in range(scenario.get('n_nodes', 1))]
+    urls = [node.start() for node in nodes]
+    try:
+        context = multiprocessing.get_context('spawn')
+        result_queue = context.Queue()
+        process = context.Process(
+            target=run_fetcher, args=(scenario, urls, result_queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Scenario {scenario['name']} failed")
+        return result_queue.get()
+    finally:
+        for node in nodes:
+            node.stop()
+
+
+def compare(results, baseline, tolerance):
+    # A metric regresses when it is worse than the baseline by more than tolerance
+    regressions = list()
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric in compared_metrics:
+            old, new = baseline[name].get(metric), metrics.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            if metric in higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def print_results(results):
+    columns = ['n_requests', 'n_sent', 'n_rate_limited', 'n_items', 'wall_s', 'requests_per_sec',
+               'items_per_sec', 'p50_ms', 'p99_ms', 'peak_rss_mb']
+    print('{:<36}'.format('scenario') +
+          ''.join('{:>18}'.format(column) for column in columns))
+    for name, metrics in results.items():
+        print('{:<36}'.format(name) + ''.join('{:>18}'.format(str(metrics[column]))
+                                              for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the RPC fetchers of ethereum.py against a local mock node.')
+    parser.add_argument('--only', nargs='*',
+                        help='Run only the scenarios whose name contains one of these strings')
+    parser.add_argument('--baseline', default=os.path.join(baselines_dir, 'rpc.json'))
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative change that counts as a regression')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    selected = [scenario for scenario in scenarios
+                if not args.only or any(text in scenario['name'] for text in args.only)]
+    results = dict()
+    for scenario in selected:
+        print(f"Running {scenario['name']}")
+        results[scenario['name']] = run_scenario(scenario)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.save_baseline:
+        baseline = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name} {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
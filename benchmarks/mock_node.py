@@ -0,0 +1,480 @@
+import json
+import multiprocessing
+import random
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_abi import encode
+from eth_utils import event_abi_to_log_topic, function_abi_to_4byte_selector, keccak
+
+# Addresses of the Compound contracts, so the synthetic logs look like the real ones
+governor_address = '0xc0Da02939E1441F497fd74F78cE7Decb17B66529'
+token_address = '0xc00e94Cb662C3520282E6f5717214004A7f26888'
+pool_address = '0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7'
+
+governor_abi = [
+    {'type': 'event', 'name': 'ProposalCreated', 'anonymous': False, 'inputs': [
+        {'name': 'id', 'type': 'uint256', 'indexed': False},
+        {'name': 'proposer', 'type': 'address', 'indexed': False},
+        {'name': 'targets', 'type': 'address[]', 'indexed': False},
+        {'name': 'values', 'type': 'uint256[]', 'indexed': False},
+        {'name': 'signatures', 'type': 'string[]', 'indexed': False},
+        {'name': 'calldatas', 'type': 'bytes[]', 'indexed': False},
+        {'name': 'startBlock', 'type': 'uint256', 'indexed': False},
+        {'name': 'endBlock', 'type': 'uint256', 'indexed': False},
+        {'name': 'description', 'type': 'string', 'indexed': False}]},
+    {'type': 'event', 'name': 'VoteCast', 'anonymous': False, 'inputs': [
+        {'name': 'voter', 'type': 'address', 'indexed': True},
+        {'name': 'proposalId', 'type': 'uint256', 'indexed': False},
+        {'name': 'support', 'type': 'uint8', 'indexed': False},
+        {'name': 'votes', 'type': 'uint256', 'indexed': False},
+        {'name': 'reason', 'type': 'string', 'indexed': False}]},
+]
+
+token_abi = [
+    {'type': 'event', 'name': 'Transfer', 'anonymous': False, 'inputs': [
+        {'name': 'from', 'type': 'address', 'indexed': True},
+        {'name': 'to', 'type': 'address', 'indexed': True},
+        {'name': 'amount', 'type': 'uint256', 'indexed': False}]},
+    {'type': 'event', 'name': 'DelegateVotesChanged', 'anonymous': False, 'inputs': [
+        {'name': 'delegate', 'type': 'address', 'indexed': True},
+        {'name': 'previousBalance', 'type': 'uint256', 'indexed': False},
+        {'name': 'newBalance', 'type': 'uint256', 'indexed': False}]},
+]
+
+pool_abi = [
+    {'type': 'function', 'name': 'balances', 'stateMutability': 'view',
+     'inputs': [{'name': 'arg0', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'uint256'}]},
+    {'type': 'function', 'name': 'totalSupply', 'stateMutability': 'view',
+     'inputs': [], 'outputs': [{'name': '', 'type': 'uint256'}]},
+]
+
+topics = {abi['name']: '0x' + event_abi_to_log_topic(abi).hex()
+          for abi in governor_abi + token_abi}
+selectors = {'0x' + function_abi_to_4byte_selector(abi).hex(): abi['name']
+             for abi in pool_abi}
+
+
+def to_hex(value):
+    return hex(value)
+
+
+def to_word(address):
+    return '0x' + '0' * 24 + address[2:].lower()
+
+
+def get_address(index):
+    return '0x' + keccak(index.to_bytes(8, 'big'))[-20:].hex()
+
+
+def get_block_hash(block_number, branch=0):
+    # Blocks replaced by a reorg get new hashes
+    if branch:
+        return '0x' + keccak(b'block' + block_number.to_bytes(8, 'big') + branch.to_bytes(4, 'big')).hex()
+    return '0x' + keccak(b'block' + block_number.to_bytes(8, 'big')).hex()
+
+
+def get_tx_hash(block_number, tx_index):
+    # The block number and index are kept in the hash to look transactions up
+    return '0x' + block_number.to_bytes(8, 'big').hex() + tx_index.to_bytes(4, 'big').hex() + \
+        keccak(b'tx' + block_number.to_bytes(8, 'big') + tx_index.to_bytes(4, 'big'))[:20].hex()
+
+
+def parse_tx_hash(tx_hash):
+    return int(tx_hash[2:18], 16), int(tx_hash[18:26], 16)
+
+
+class RawJSON(str):
+    # A result already serialized to JSON, sent as it is
+    pass
+
+
+def encode_response(response):
+    result = response.get('result')
+    if isinstance(result, RawJSON):
+        return '{{"jsonrpc": "2.0", "id": {}, "result": {}}}'.format(json.dumps(response['id']), result)
+    return json.dumps(response)
+
+
+class ChainData:
+    # Deterministic synthetic chain: the content of a block only depends on
+    # the seed and the block number. Logs, blocks and receipts are cached
+    # already serialized, and preload() builds them for a block range up
+    # front, so the benchmarks measure the configured latency and not the
+    # ABI encoding and hashing of this process. The non-standard mock_setHead
+    # and mock_reorg methods move the head and replace the blocks from a given
+    # number with a new branch with other hashes and logs.
+
+    def __init__(self, head=20_563_000, seed=0, votes_per_block=0.5, transfers_per_block=4,
+                 delegations_per_block=0.5, proposals_per_block=0.001, n_accounts=10_000, txs_per_block=150):
+        self.head = head
+        self.seed = seed
+        self.votes_per_block = votes_per_block
+        self.transfers_per_block = transfers_per_block
+        self.delegations_per_block = delegations_per_block
+        self.proposals_per_block = proposals_per_block
+        self.n_accounts = n_accounts
+        self.txs_per_block = txs_per_block
+        self.reorgs = list()
+        self.get_logs = lru_cache(maxsize=100_000)(self.get_logs)
+        self.get_encoded_logs = lru_cache(
+            maxsize=100_000)(self.get_encoded_logs)
+        self.get_encoded_block = lru_cache(
+            maxsize=100_000)(self.get_encoded_block)
+        self.get_encoded_receipts = lru_cache(
+            maxsize=10_000)(self.get_encoded_receipts)
+
+    def preload(self, logs=None, blocks=None, receipts=None):
+        # Each argument is an inclusive (start_block, end_block) range
+        def get_encoded_block(block_number):
+            return self.get_encoded_block(block_number, False)
+
+        for block_range, get_encoded in ((logs, self.get_encoded_logs), (blocks, get_encoded_block),
+                                         (receipts, self.get_encoded_receipts)):
+            if block_range is None:
+                continue
+            start_block, end_block = block_range
+            for block_number in range(start_block, min(end_block, self.head) + 1):
+                get_encoded(block_number)
+
+    def get_branch(self, block_number):
+        return sum(1 for reorg_block in self.reorgs if reorg_block <= block_number)
+
+    def get_block_hash(self, block_number):
+        return get_block_hash(block_number, self.get_branch(block_number))
+
+    def get_random(self, block_number, branch=0):
+        if branch:
+            return random.Random(f'{self.seed}-{block_number}-{branch}')
+        return random.Random(self.seed * 1_000_000_000 + block_number)
+
+    def reorg(self, block_number):
+        self.reorgs.append(block_number)
+        for cached in (self.get_logs, self.get_encoded_logs, self.get_encoded_block, self.get_encoded_receipts):
+            cached.cache_clear()
+
+    def get_count(self, rnd, rate):
+        # Poisson-like number of events for a rate per block
+        count = int(rate)
+        if rnd.random() < rate - count:
+            count += 1
+        return count
+
+    def get_account(self, rnd):
+        # A few accounts make most of the activity
+        return get_address(min(int(rnd.paretovariate(1.2)), self.n_accounts))
+
+    def get_logs(self, block_number):
+        rnd = self.get_random(block_number, self.get_branch(block_number))
+        logs = list()
+
+        def add_log(address, event_name, indexed, data):
+            tx_index = len(logs)
+            logs.append({
+                'address': address.lower(),
+                'topics': [topics[event_name]] + [to_word(value) for value in indexed],
+                'data': '0x' + data.hex(),
+                'blockNumber': to_hex(block_number),
+                'blockHash': self.get_block_hash(block_number),
+                'transactionHash': get_tx_hash(block_number, tx_index),
+                'transactionIndex': to_hex(tx_index),
+                'logIndex': to_hex(tx_index),
+                'removed': False})
+
+        for _ in range(self.get_count(rnd, self.proposals_per_block)):
+            add_log(governor_address, 'ProposalCreated', [], encode(
+                ['uint256', 'address', 'address[]', 'uint256[]', 'string[]',
+                    'bytes[]', 'uint256', 'uint256', 'string'],
+                [block_number, self.get_account(rnd), [token_address], [0], ['_setReserveFactor(uint256)'],
+                 [b'\x00' * 32], block_number + 13_140, block_number + 32_850, '# Synthetic proposal\nDescription']))
+        for _ in range(self.get_count(rnd, self.votes_per_block)):
+            add_log(governor_address, 'VoteCast', [self.get_account(rnd)], encode(
+                ['uint256', 'uint8', 'uint256', 'string'],
+                [rnd.randint(1, 300), rnd.randint(0, 2), rnd.randint(0, 10**24), '']))
+        for _ in range(self.get_count(rnd, self.transfers_per_block)):
+            add_log(token_address, 'Transfer', [self.get_account(rnd), self.get_account(rnd)],
+                    encode(['uint256'], [rnd.randint(0, 10**22)]))
+        for _ in range(self.get_count(rnd, self.delegations_per_block)):
+            add_log(token_address, 'DelegateVotesChanged', [self.get_account(rnd)],
+                    encode(['uint256', 'uint256'], [rnd.randint(0, 10**24), rnd.randint(0, 10**24)]))
+        return logs
+
+    def get_encoded_logs(self, block_number):
+        # (address, topic0, JSON) of each log, the fields eth_getLogs filters by
+        return [(log['address'], log['topics'][0], json.dumps(log)) for log in self.get_logs(block_number)]
+
+    def get_n_txs(self, block_number):
+        return max(len(self.get_logs(block_number)), self.txs_per_block)
+
+    def get_transaction(self, block_number, tx_index):
+        rnd = self.get_random(block_number * 1_000 + tx_index)
+        return {
+            'hash': get_tx_hash(block_number, tx_index),
+            'blockHash': self.get_block_hash(block_number),
+            'blockNumber': to_hex(block_number),
+            'transactionIndex': to_hex(tx_index),
+            'from': self.get_account(rnd),
+            'to': governor_address.lower(),
+            'value': '0x0',
+            'gas': to_hex(200_000),
+            'gasPrice': to_hex(rnd.randint(10**9, 10**11)),
+            'nonce': to_hex(rnd.randint(0, 1000)),
+            'input': '0x',
+            'type': '0x2',
+            'chainId': '0x1',
+            'v': '0x0', 'r': '0x1', 's': '0x1'}
+
+    def get_receipt(self, block_number, tx_index):
+        rnd = self.get_random(block_number * 1_000 + tx_index)
+        logs = [log for log in self.get_logs(block_number)
+                if log['transactionIndex'] == to_hex(tx_index)]
+        return {
+            'transactionHash': get_tx_hash(block_number, tx_index),
+            'transactionIndex': to_hex(tx_index),
+            'blockHash': self.get_block_hash(block_number),
+            'blockNumber': to_hex(block_number),
+            'from': self.get_account(rnd),
+            'to': governor_address.lower(),
+            'cumulativeGasUsed': to_hex(21_000 * (tx_index + 1)),
+            'gasUsed': to_hex(rnd.randint(21_000, 200_000)),
+            'effectiveGasPrice': to_hex(rnd.randint(10**9, 10**11)),
+            'contractAddress': None,
+            'logs': logs,
+            'logsBloom': '0x' + '00' * 256,
+            'status': '0x1',
+            'type': '0x2'}
+
+    def get_block(self, block_number, full_transactions=False):
+        if block_number > self.head:
+            return None
+        n_txs = self.get_n_txs(block_number)
+        if full_transactions:
+            transactions = [self.get_transaction(block_number, tx_index)
+                            for tx_index in range(n_txs)]
+        else:
+            transactions = [get_tx_hash(block_number, tx_index)
+                            for tx_index in range(n_txs)]
+        return {
+            'number': to_hex(block_number),
+            'hash': self.get_block_hash(block_number),
+            'parentHash': self.get_block_hash(max(block_number - 1, 0)),
+            'timestamp': to_hex(1_438_269_973 + 12 * block_number),
+            'miner': get_address(block_number % 50),
+            'gasLimit': to_hex(30_000_000),
+            'gasUsed': to_hex(15_000_000),
+            'baseFeePerGas': to_hex(10**10),
+            'difficulty': '0x0',
+            'totalDifficulty': '0x0',
+            'extraData': '0x',
+            'logsBloom': '0x' + '00' * 256,
+            'nonce': '0x0000000000000000',
+            'sha3Uncles': '0x' + '00' * 32,
+            'size': to_hex(1000 + 100 * n_txs),
+            'stateRoot': '0x' + '00' * 32,
+            'receiptsRoot': '0x' + '00' * 32,
+            'transactionsRoot': '0x' + '00' * 32,
+            'mixHash': '0x' + '00' * 32,
+            'uncles': [],
+            'transactions': transactions}
+
+    def get_encoded_block(self, block_number, full_transactions):
+        return RawJSON(json.dumps(self.get_block(block_number, full_transactions=full_transactions)))
+
+    def get_encoded_receipts(self, block_number):
+        return RawJSON(json.dumps([self.get_receipt(block_number, tx_index)
+                                   for tx_index in range(self.get_n_txs(block_number))]))
+
+    def get_block_number(self, block_identifier):
+        if block_identifier in ('latest', 'pending', 'safe', 'finalized'):
+            return self.head
+        if block_identifier == 'earliest':
+            return 0
+        return int(block_identifier, 16)
+
+    def filter_logs(self, params):
+        from_block = self.get_block_number(params.get('fromBlock', 'latest'))
+        to_block = min(self.get_block_number(
+            params.get('toBlock', 'latest')), self.head)
+        addresses = params.get('address')
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = {address.lower() for address in addresses} if addresses else None
+        topic0 = params.get('topics', [None])[0] if params.get('topics') else None
+        if isinstance(topic0, str):
+            topic0 = [topic0]
+        logs = list()
+        for block_number in range(from_block, to_block + 1):
+            for address, log_topic0, log in self.get_encoded_logs(block_number):
+                if addresses is not None and address not in addresses:
+                    continue
+                if topic0 is not None and log_topic0 not in topic0:
+                    continue
+                logs.append(log)
+        return RawJSON('[' + ', '.join(logs) + ']')
+
+    def call(self, params, block_identifier):
+        block_number = self.get_block_number(block_identifier)
+        data = params.get('data') or params.get('input')
+        function_name = selectors.get(data[:10])
+        if function_name == 'balances':
+            index = int(data[10:], 16)
+            value = self.get_random(block_number).randint(
+                10**20, 10**26) + index
+        elif function_name == 'totalSupply':
+            value = 10**25 + block_number
+        else:
+            raise ValueError('execution reverted')
+        return '0x' + encode(['uint256'], [value]).hex()
+
+    def handle(self, method, params):
+        if method == 'web3_clientVersion':
+            return 'MockNode/v0.1'
+        if method == 'eth_chainId':
+            return '0x1'
+        if method == 'net_version':
+            return '1'
+        if method == 'eth_blockNumber':
+            return to_hex(self.head)
+        if method == 'eth_getBlockByNumber':
+            block_number = self.get_block_number(params[0])
+            if block_number > self.head:
+                return None
+            return self.get_encoded_block(block_number, bool(params[1]))
+        if method == 'eth_getLogs':
+            return self.filter_logs(params[0])
+        if method == 'eth_getTransactionByHash':
+            return self.get_transaction(*parse_tx_hash(params[0]))
+        if method == 'eth_getTransactionReceipt':
+            return self.get_receipt(*parse_tx_hash(params[0]))
+        if method == 'eth_getBlockReceipts':
+            return self.get_encoded_receipts(self.get_block_number(params[0]))
+        if method == 'eth_call':
+            return self.call(params[0], params[1] if len(params) > 1 else 'latest')
+        if method == 'mock_setHead':
+            self.head = params[0]
+            return True
+        if method == 'mock_reorg':
+            self.reorg(params[0])
+            return True
+        raise NotImplementedError(method)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def make_handler(chain, latency=0.0, jitter=0.0, tail_probability=0.0, tail_latency=0.0,
+                 rate_limit=None, error_rate=0.0, seed=0):
+    bucket = TokenBucket(rate_limit) if rate_limit else None
+    rnd = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body):
+            body = encode_response(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(
+                int(self.headers['Content-Length'])))
+            delay = latency + rnd.uniform(0, jitter)
+            if rnd.random() < tail_probability:
+                delay += tail_latency
+            time.sleep(delay)
+            if bucket is not None and not bucket.acquire():
+                self.send(429, {'jsonrpc': '2.0', 'id': request.get('id'),
+                                'error': {'code': -32005, 'message': 'rate limit exceeded'}})
+                return
+            if rnd.random() < error_rate:
+                self.send(503, {'jsonrpc': '2.0', 'id': request.get('id'),
+                                'error': {'code': -32603, 'message': 'injected error'}})
+                return
+            try:
+                response = {'jsonrpc': '2.0', 'id': request['id'],
+                            'result': chain.handle(request['method'], request.get('params', []))}
+            except Exception as e:
+                response = {'jsonrpc': '2.0', 'id': request['id'],
+                            'error': {'code': -32000, 'message': str(e)}}
+            self.send(200, response)
+
+    return Handler
+
+
+def serve(port_queue, chain_kwargs, handler_kwargs, preload):
+    chain = ChainData(**chain_kwargs)
+    chain.preload(**preload)
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), make_handler(chain, **handler_kwargs))
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class MockNode:
+    # Local JSON-RPC stand-in for an Ethereum archive node, served from a
+    # separate process so it does not compete with the client for the GIL.
+    # Latency (with jitter and a slow tail), a rate limit in requests per
+    # second and a rate of injected HTTP 503 errors are configurable. Nodes
+    # with the same seed serve the same chain; node_id only changes the
+    # latency and error draws, so a pool of nodes stays consistent. preload
+    # takes the block ranges of ChainData.preload, built before the node
+    # starts answering.
+
+    def __init__(self, latency=0.0, jitter=0.0, tail_probability=0.0, tail_latency=0.0,
+                 rate_limit=None, error_rate=0.0, seed=0, node_id=0, preload=None, **chain_kwargs):
+        self.chain_kwargs = dict(chain_kwargs, seed=seed)
+        self.preload = preload or dict()
+        self.handler_kwargs = {'latency': latency, 'jitter': jitter, 'tail_probability': tail_probability,
+                               'tail_latency': tail_latency, 'rate_limit': rate_limit,
+                               'error_rate': error_rate, 'seed': seed * 1000 + node_id}
+        self.process = None
+        self.url = None
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        port_queue = context.Queue()
+        self.process = context.Process(target=serve, args=(port_queue, self.chain_kwargs, self.handler_kwargs,
+                                                          self.preload), daemon=True)
+        self.process.start()
+        # Preloading a large block range takes a while
+        self.url = 'http://127.0.0.1:{}'.format(port_queue.get(timeout=600))
+        return self.url
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
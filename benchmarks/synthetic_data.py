@@ -0,0 +1,229 @@
+import argparse
+import gzip
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+start_block = 9_600_000
+start_timestamp = 1_583_020_800
+block_time = 12
+decimals = 10**18
+
+governor_address = '0xc0Da02939E1441F497fd74F78cE7Decb17B66529'
+token_address = '0xc00e94Cb662C3520282E6f5717214004A7f26888'
+
+# Share of the token and vote events; the proposal lifecycle events follow
+# from the number of proposals
+event_mix = {'Transfer': .5, 'VoteCast': .3,
+             'DelegateVotesChanged': .15, 'DelegateChanged': .05}
+lifecycle_events = ['ProposalCreated', 'ProposalCanceled',
+                    'ProposalQueued', 'ProposalExecuted']
+event_names = list(event_mix) + lifecycle_events
+votes_per_proposal = 500
+voting_period = 19_710
+
+words = ['governance', 'proposal', 'reserve', 'factor', 'market', 'upgrade', 'oracle', 'collateral',
+         'interest', 'rate', 'model', 'treasury', 'grant', 'delegate', 'parameter', 'risk']
+
+
+def get_zipf_ranks(rng, size, n, a=1.1):
+    # Bounded Zipf ranks in [0, n) from the inverse CDF of the continuous
+    # power law, so no table of n weights is kept in memory
+    u = rng.random(size)
+    if a == 1:
+        ranks = np.exp(u * np.log(n + 1))
+    else:
+        ranks = (((n + 1) ** (1 - a) - 1) * u + 1) ** (1 / (1 - a))
+    return np.minimum(ranks.astype(np.int64) - 1, n - 1)
+
+
+def get_address(index):
+    # Spread the indices over the address space
+    return '0x{:040x}'.format((int(index) + 1) * 0x9E3779B97F4A7C15F39CC0605CEDC8341082276B % 2**160)
+
+
+def get_addresses(indices):
+    # Popular addresses repeat a lot, so each one is formatted once per chunk
+    unique, inverse = np.unique(indices, return_inverse=True)
+    table = [get_address(index) for index in unique]
+    return [table[index] for index in inverse]
+
+
+def get_block_hash(block_number):
+    return HexBytes((int(block_number) * 0x9E3779B97F4A7C15F39CC0605CEDC8341082276BF3A27251F86C6A11D0C18E95 % 2**256).to_bytes(32, 'big'))
+
+
+def get_amounts(rng, size, mean=3, sigma=2.5):
+    # Token amounts in wei, heavy tailed like the real balances
+    return [int(amount * decimals) for amount in rng.lognormal(mean, sigma, size)]
+
+
+def get_description(rng, proposal_id):
+    title = ' '.join(rng.choice(words, 4)).capitalize()
+    body = ' '.join(rng.choice(words, int(rng.integers(50, 500))))
+    return f'# {title} {proposal_id}\n\n{body}'
+
+
+class SyntheticGovernance:
+    # Deterministic event streams of one governor and its token, shaped like
+    # the events returned by web3 (AttributeDicts with HexBytes hashes). Each
+    # stream is generated in chunks with its own random generator, so any
+    # chunk can be rebuilt alone and memory stays bounded by chunk_size even
+    # for 10^8 events. Addresses follow a Zipf distribution.
+
+    def __init__(self, n_events, seed=0, chunk_size=100_000, n_addresses=None, zipf_a=1.1,
+                 events_per_block=5, mix=event_mix):
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.zipf_a = zipf_a
+        self.counts = {event_name: int(n_events * share)
+                       for event_name, share in mix.items()}
+        self.n_addresses = n_addresses or max(1000, n_events // 20)
+        self.first_block = start_block
+        self.last_block = start_block + max(1000, n_events // events_per_block)
+
+        # Proposal ids start at 1; a tenth is canceled and most of the others
+        # are queued and then executed
+        self.n_proposals = max(10, self.counts.get(
+            'VoteCast', 0) // votes_per_proposal)
+        rng = np.random.default_rng([seed, len(event_names)])
+        proposal_ids = np.arange(1, self.n_proposals + 1)
+        status = rng.random(self.n_proposals)
+        self.proposal_ids = {
+            'ProposalCreated': proposal_ids,
+            'ProposalCanceled': proposal_ids[status < .1],
+            'ProposalQueued': proposal_ids[status >= .4],
+            'ProposalExecuted': proposal_ids[status >= .45]}
+        self.proposal_blocks = np.sort(rng.integers(
+            self.first_block, max(self.first_block + 1, self.last_block - 2 * voting_period), self.n_proposals))
+        for event_name in lifecycle_events:
+            self.counts[event_name] = len(self.proposal_ids[event_name])
+
+    def get_n_chunks(self, event_name):
+        return -(-self.counts[event_name] // self.chunk_size)
+
+    def get_chunk(self, event_name, chunk_index):
+        rng = np.random.default_rng(
+            [self.seed, event_names.index(event_name), chunk_index])
+        start = chunk_index * self.chunk_size
+        size = min(self.chunk_size, self.counts[event_name] - start)
+        if event_name in lifecycle_events:
+            args, block_numbers = self.get_lifecycle_args(
+                event_name, rng, start, size)
+        else:
+            # Each chunk covers its share of the block range, so the stream
+            # is sorted by block like the gathered events
+            n_chunks = self.get_n_chunks(event_name)
+            span = self.last_block - self.first_block
+            block_numbers = np.sort(rng.integers(self.first_block + span * chunk_index // n_chunks,
+                                                 self.first_block + span * (chunk_index + 1) // n_chunks, size))
+            args = self.get_args(event_name, rng, size)
+
+        address = governor_address if event_name == 'VoteCast' or event_name in lifecycle_events else token_address
+        tx_hashes = rng.bytes(32 * size)
+        tx_indices = rng.integers(0, 200, size).tolist()
+        log_indices = rng.integers(0, 400, size).tolist()
+        block_hashes = dict()
+        events = list()
+        for index, block_number in enumerate(block_numbers.tolist()):
+            if block_number not in block_hashes:
+                block_hashes[block_number] = get_block_hash(block_number)
+            events.append(AttributeDict({
+                'args': AttributeDict({name: values[index] for name, values in args.items()}),
+                'event': event_name,
+                'logIndex': log_indices[index],
+                'transactionIndex': tx_indices[index],
+                'transactionHash': HexBytes(tx_hashes[32 * index:32 * (index + 1)]),
+                'address': address,
+                'blockHash': block_hashes[block_number],
+                'blockNumber': block_number}))
+        return events
+
+    def get_args(self, event_name, rng, size):
+        def get_accounts():
+            return get_addresses(get_zipf_ranks(rng, size, self.n_addresses, self.zipf_a))
+
+        if event_name == 'Transfer':
+            return {'from': get_accounts(), 'to': get_accounts(), 'amount': get_amounts(rng, size)}
+        if event_name == 'VoteCast':
+            # A few proposals attract most of the votes
+            proposal_ids = get_zipf_ranks(
+                rng, size, self.n_proposals, self.zipf_a) + 1
+            return {'voter': get_accounts(), 'proposalId': proposal_ids.tolist(),
+                    'support': rng.choice(3, size, p=[.25, .7, .05]).tolist(),
+                    'votes': get_amounts(rng, size), 'reason': [''] * size}
+        if event_name == 'DelegateVotesChanged':
+            return {'delegate': get_accounts(), 'previousBalance': get_amounts(rng, size),
+                    'newBalance': get_amounts(rng, size)}
+        if event_name == 'DelegateChanged':
+            return {'delegator': get_accounts(), 'fromDelegate': get_accounts(), 'toDelegate': get_accounts()}
+        raise ValueError(f"Event {event_name} not recognized")
+
+    def get_lifecycle_args(self, event_name, rng, start, size):
+        proposal_ids = self.proposal_ids[event_name][start:start + size]
+        created_blocks = self.proposal_blocks[proposal_ids - 1]
+        if event_name == 'ProposalCreated':
+            n_actions = rng.integers(1, 4, size)
+            args = {'id': proposal_ids.tolist(),
+                    'proposer': get_addresses(get_zipf_ranks(rng, size, self.n_addresses, self.zipf_a)),
+                    'targets': [get_addresses(rng.integers(0, self.n_addresses, n)) for n in n_actions],
+                    'values': [[0] * n for n in n_actions],
+                    'signatures': [['_setReserveFactor(uint256)'] * n for n in n_actions],
+                    'calldatas': [[rng.bytes(32)] * n for n in n_actions],
+                    'startBlock': (created_blocks + 13_140).tolist(),
+                    'endBlock': (created_blocks + 13_140 + voting_period).tolist(),
+                    'description': [get_description(rng, proposal_id) for proposal_id in proposal_ids]}
+            return args, created_blocks
+        offset = {'ProposalCanceled': 100, 'ProposalQueued': 13_140 + voting_period + 1,
+                  'ProposalExecuted': 13_140 + voting_period + 13_140}[event_name]
+        block_numbers = created_blocks + offset
+        args = {'id': proposal_ids.tolist()}
+        if event_name == 'ProposalQueued':
+            args['eta'] = (start_timestamp + (block_numbers - start_block)
+                           * block_time + 2 * 86400).tolist()
+        return args, block_numbers
+
+    def get_events(self, event_name):
+        # Generator of the chunks of one event stream
+        for chunk_index in range(self.get_n_chunks(event_name)):
+            yield self.get_chunk(event_name, chunk_index)
+
+    def get_blocks_df(self):
+        # Block timestamps in the format of the 01b notebook output
+        number = np.arange(self.first_block, self.last_block +
+                           2 * (13_140 + voting_period) + 1)
+        return pd.DataFrame({'number': number, 'timestamp': pd.to_datetime(
+            start_timestamp + (number - start_block) * block_time, unit='s')})
+
+
+def save_events(path_dir, synthetic, event_names=event_names):
+    # Store each chunk as a gzip pickle, as the events gathered by 01a
+    os.makedirs(path_dir, exist_ok=True)
+    files = list()
+    for event_name in event_names:
+        for chunk_index, events in enumerate(synthetic.get_events(event_name)):
+            file_dir = os.path.join(
+                path_dir, f'events_{event_name}_{chunk_index:05d}.pkl.gz')
+            with gzip.open(file_dir, 'wb') as f:
+                pickle.dump(events, f)
+            files.append(file_dir)
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic governance event streams.')
+    parser.add_argument('path_dir')
+    parser.add_argument('--n-events', type=float, default=1e6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--zipf-a', type=float, default=1.1)
+    args = parser.parse_args()
+    synthetic = SyntheticGovernance(int(args.n_events), seed=args.seed, chunk_size=args.chunk_size,
+                                    zipf_a=args.zipf_a)
+    files = save_events(args.path_dir, synthetic)
+    print(f"{len(files)} files written to {args.path_dir}")
@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from tqdm import tqdm
+
+data_url = 'https://blockchain.mpi-sws.org/datasets/files/decentralized-governance/dataset'
+
+
+def load_manifest(data_dir):
+    with open(os.path.join(data_dir, 'files.json')) as f:
+        return json.load(f)
+
+
+def save_manifest(data_dir, manifest):
+    file_dir = os.path.join(data_dir, 'files.json')
+    with open(file_dir + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(file_dir + '.tmp', file_dir)
+
+
+def get_entries(manifest):
+    # Manifest entries are either a filename or a dict with the filename and
+    # the expected size and sha256 of the file
+    entries = list()
+    for folder, files in manifest.items():
+        for index, item in enumerate(files):
+            entry = item if isinstance(item, dict) else {'name': item}
+            entries.append(dict(entry, folder=folder, index=index))
+    return entries
+
+
+def get_url(base_url, folder, filename):
+    if folder == 'others':
+        return '/'.join([base_url, filename])
+    return '/'.join([base_url, folder, filename])
+
+
+def get_local_dir(data_dir, folder):
+    return data_dir if folder == 'others' else os.path.join(data_dir, folder)
+
+
+def get_sha256(file_dir, chunk_size=2**20):
+    sha256 = hashlib.sha256()
+    with open(file_dir, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def verify_file(file_dir, size=None, sha256=None):
+    # Without an expected size or sha256 the file cannot be trusted
+    if not os.path.exists(file_dir) or (size is None and sha256 is None):
+        return False
+    if size is not None and os.path.getsize(file_dir) != size:
+        return False
+    if sha256 is not None and get_sha256(file_dir) != sha256:
+        return False
+    return True
+
+
+def get_remote_size(session, url, timeout=60):
+    rq = session.head(url, allow_redirects=True, timeout=timeout)
+    rq.raise_for_status()
+    size = rq.headers.get('Content-Length')
+    return int(size) if size is not None else None
+
+
+def download_file(session, url, file_dir, size=None, chunk_size=2**20, timeout=60, n_err=5):
+    # Download into a .part file, resuming it with an HTTP range request. Each
+    # attempt that does not leave a file of the expected size counts as an
+    # error, so a recorded size that no longer matches the remote file fails
+    # instead of looping forever.
+    part_dir = file_dir + '.part'
+    mismatch = False
+    while n_err > 0:
+        try:
+            offset = os.path.getsize(part_dir) if os.path.exists(part_dir) else 0
+            if size is not None and offset == size:
+                break
+            headers = {'Range': f'bytes={offset}-'} if offset else dict()
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as rq:
+                if rq.status_code == 416:
+                    # The part file is longer than the remote file
+                    os.remove(part_dir)
+                    mismatch = True
+                else:
+                    rq.raise_for_status()
+                    # The server ignored the range and is sending the whole file
+                    mode = 'ab' if rq.status_code == 206 else 'wb'
+                    with open(part_dir, mode) as f:
+                        for chunk in rq.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                    if size is None or os.path.getsize(part_dir) == size:
+                        break
+                    mismatch = True
+        except (requests.RequestException, TimeoutError):
+            mismatch = False
+            time.sleep(.5)
+        n_err -= 1
+    if n_err == 0:
+        if mismatch and size is not None:
+            if os.path.exists(part_dir):
+                os.remove(part_dir)
+            raise ValueError(f'Error: Size mismatch for {url}, expected {size} bytes')
+        raise TimeoutError(f'Error: Cannot download {url}')
+    os.replace(part_dir, file_dir)
+    return file_dir
+
+
+def convert_to_pickle(file_dir):
+    # Pickled dataframes load much faster than the compressed CSV files and
+    # keep the timestamps parsed
+    df = pd.read_csv(file_dir)
+    if 'timestamp' in df.columns:
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    pickle_dir = file_dir.replace('.csv.gz', '').replace('.csv', '') + '.pkl'
+    df.to_pickle(pickle_dir)
+    return pickle_dir
+
+
+def fetch_entry(session, entry, data_dir, base_url, convert=False, timeout=60):
+    local_dir = get_local_dir(data_dir, entry['folder'])
+    os.makedirs(local_dir, exist_ok=True)
+    file_dir = os.path.join(local_dir, entry['name'])
+    url = get_url(base_url, entry['folder'], entry['name'])
+
+    size, sha256 = entry.get('size'), entry.get('sha256')
+    status = 'verified'
+    if not verify_file(file_dir, size=size, sha256=sha256):
+        if size is None:
+            size = get_remote_size(session, url, timeout=timeout)
+        # Files without a recorded checksum are only checked by their size
+        if sha256 is not None or not verify_file(file_dir, size=size):
+            download_file(session, url, file_dir, size=size, timeout=timeout)
+            status = 'downloaded'
+        file_sha256 = get_sha256(file_dir)
+        if sha256 is not None and sha256 != file_sha256:
+            os.remove(file_dir)
+            raise ValueError(f'Error: Checksum mismatch for {url}')
+        sha256 = file_sha256
+
+    if convert and entry['name'].endswith(('.csv', '.csv.gz')):
+        convert_to_pickle(file_dir)
+    return dict(entry, size=os.path.getsize(file_dir), sha256=sha256, status=status)
+
+
+def download_dataset(data_dir, base_url=data_url, max_workers=8, record=True, convert=False, timeout=60):
+    # Download all the files of data/files.json concurrently. With record=True
+    # the size and sha256 of each file are written back to the manifest, so
+    # later runs can verify the files without the network.
+    manifest = load_manifest(data_dir)
+    entries = get_entries(manifest)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    results = list()
+    errors = list()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch_entry, session, entry, data_dir, base_url,
+                               convert=convert, timeout=timeout): entry for entry in entries}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Downloading files...'):
+            entry = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error downloading {entry['name']}: {e}")
+                errors.append((entry, e))
+                continue
+            results.append(result)
+            if record:
+                manifest[entry['folder']][entry['index']] = {
+                    'name': result['name'], 'size': result['size'], 'sha256': result['sha256']}
+
+    if record:
+        save_manifest(data_dir, manifest)
+    print("{} files downloaded, {} already verified, {} errors".format(
+        sum(result['status'] == 'downloaded' for result in results),
+        sum(result['status'] == 'verified' for result in results), len(errors)))
+    return results, errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Download and verify the files listed in data/files.json.')
+    parser.add_argument('--data-dir', default=os.path.realpath(
+        os.path.join(os.path.dirname(__file__), '..', 'data')))
+    parser.add_argument('--base-url', default=data_url)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--no-record', action='store_true',
+                        help='Do not write sizes and checksums to the manifest')
+    parser.add_argument('--convert', action='store_true',
+                        help='Also store the CSV files as pickled dataframes')
+    args = parser.parse_args()
+    download_dataset(args.data_dir, base_url=args.base_url, max_workers=args.max_workers,
+                     record=not args.no_record, convert=args.convert)
@@ -81,11 +81,10 @@ def get_events_from_contract(params):
     filtered_event = list()
     n_err = 15
     while n_err > 0:
-        # filtered_events_function = contract_event_function.get_logs(
-        #     fromBlock=start_block, toBlock=end_block)
+        # web3 v7 renamed the fromBlock and toBlock arguments of get_logs
         try:
             filtered_event = contract_event_function.get_logs(
-                fromBlock=start_block, toBlock=end_block)
+                from_block=start_block, to_block=end_block)
             break
         except TimeoutError:
             n_err -= 1
@@ -99,7 +98,8 @@ def get_batch_intervals(block_start, block_end, batch_size):
     # Improved version of the line code below
     # pd.interval_range(start=block_number_min, end=block_number_max, freq=batch_size)
     intervals = list()
-    block_numbers = list(range(block_start, block_end, batch_size))
+    # block_end is inclusive
+    block_numbers = list(range(block_start, block_end + 1, batch_size))
     for block_number in block_numbers:
         block_interval_start = block_number
         block_interval_end = min(block_number + batch_size - 1, block_end)
@@ -0,0 +1,329 @@
+import argparse
+import copy
+import gzip
+import os
+import pickle
+import time
+
+import pandas as pd
+from eth_utils import event_abi_to_log_topic
+from web3._utils.events import get_event_data
+from web3.exceptions import BlockNotFound, Web3RPCError
+
+from ethereum import get_contract
+from rpc_pool import RetriesExhaustedError, get_w3, is_log_limit_message
+from settings import block_max_ethereum, contract_settings
+
+supports = {0: 'against', 1: 'in_favor', 2: 'abstain'}
+
+# Events GovernanceState.apply is built from; the other logs are not fetched
+applied_events = ['ProposalCreated', 'ProposalQueued', 'ProposalExecuted',
+                  'ProposalCanceled', 'VoteCast', 'DelegateVotesChanged']
+
+
+class GovernanceState:
+    # Proposal tallies and delegates voting power built from decoded events
+
+    def __init__(self, decimals=1e18):
+        self.decimals = decimals
+        self.proposals = dict()
+        self.tallies = dict()
+        self.voting_power = dict()
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def apply(self, contract_name, event):
+        args = event['args']
+        if event['event'] == 'ProposalCreated':
+            self.proposals[(contract_name, args['id'])] = {
+                'proposer': args['proposer'].lower(),
+                'startBlock': args['startBlock'],
+                'endBlock': args['endBlock'],
+                'proposal_title': args['description'].split('\n')[0].replace('#', '').strip(),
+                'blockNumber': event['blockNumber'],
+                'status': 'active'}
+        elif event['event'] in ('ProposalQueued', 'ProposalExecuted', 'ProposalCanceled'):
+            proposal = self.proposals.get((contract_name, args['id']))
+            if proposal is not None:
+                proposal['status'] = event['event'].replace(
+                    'Proposal', '').lower()
+        elif event['event'] == 'VoteCast':
+            tally = self.tallies.setdefault((contract_name, args['proposalId']),
+                                            {'against': 0, 'in_favor': 0, 'abstain': 0, 'n_voters': 0})
+            # Governor Alpha emits a boolean support, Bravo emits 0, 1 or 2
+            tally[supports[int(args['support'])]] += args['votes'] / self.decimals
+            tally['n_voters'] += 1
+        elif event['event'] == 'DelegateVotesChanged':
+            self.voting_power[(contract_name, args['delegate'].lower())
+                              ] = args['newBalance'] / self.decimals
+
+    def get_open_proposals(self, block_number):
+        # Proposals still accepting votes at block_number with their tallies
+        data = list()
+        for (contract_name, proposal_id), proposal in self.proposals.items():
+            if proposal['status'] == 'active' and proposal['endBlock'] >= block_number:
+                tally = self.tallies.get((contract_name, proposal_id), dict())
+                data.append({'contract_name': contract_name, 'proposalId': proposal_id,
+                             **proposal, **tally})
+        return pd.DataFrame(data)
+
+
+class ChainFollower:
+    # Follows the chain head and fetches the logs of all the contracts with a
+    # single eth_getLogs request per poll, filtered by the topics of the
+    # applied events. Ranges the node refuses to return are split in halves.
+    # Events of the last `confirmations` blocks are kept apart, so when a
+    # reorg is detected (the stored hash of a block differs from the chain's)
+    # they can be rolled back and the live state rebuilt from the confirmed
+    # one. The hash of the last confirmed block is kept as well, and a reorg
+    # that changes it raises a ValueError.
+    # w3s holds one Web3 per node. Each poll reads the head, hashes and logs
+    # from a single node, since nodes at different heights or on different
+    # branches would make logs look missing or blocks look reorged. The
+    # follower moves to the next node when the current one fails or falls
+    # behind.
+
+    def __init__(self, w3s, contracts, start_block, confirmations=12, max_range=2000,
+                 state=None, on_events=None, on_reorg=None):
+        if not isinstance(w3s, (list, tuple)):
+            w3s = [w3s]
+        self.w3s = list(w3s)
+        self.node = 0
+        self.w3 = self.w3s[0]
+        self.contracts = contracts
+        self.confirmations = confirmations
+        self.max_range = max_range
+        self.last_block = start_block - 1
+        self.confirmed_block = start_block - 1
+        self.confirmed = state or GovernanceState()
+        self.live = self.confirmed.copy()
+        self.pending = list()
+        self.block_hashes = dict()
+        self.on_events = on_events
+        self.on_reorg = on_reorg
+
+        self.addresses = sorted({contract.address for contract in contracts.values()})
+        self.event_abis = dict()
+        for contract_name, contract in contracts.items():
+            for abi in contract.abi:
+                if abi['type'] != 'event' or abi['name'] not in applied_events:
+                    continue
+                key = (contract.address.lower(),
+                       '0x' + event_abi_to_log_topic(abi).hex())
+                # Contracts sharing an address (e.g., governor upgrades) are
+                # attributed to the first one in contracts
+                self.event_abis.setdefault(key, (contract_name, abi))
+        # Governor Alpha and Bravo emit VoteCast with different signatures
+        self.topics = sorted({topic for _, topic in self.event_abis})
+
+    def decode_log(self, log):
+        if not log['topics']:
+            return None
+        key = (log['address'].lower(), '0x' + bytes(log['topics'][0]).hex())
+        if key not in self.event_abis:
+            return None
+        contract_name, abi = self.event_abis[key]
+        return contract_name, get_event_data(self.w3.codec, abi, log)
+
+    def get_block_hash(self, block_number):
+        try:
+            return bytes(self.w3.eth.get_block(block_number)['hash']).hex()
+        except BlockNotFound:
+            return None
+
+    def get_logs(self, from_block, to_block):
+        # Split the range in halves while the node refuses to return its logs
+        try:
+            return self.w3.eth.get_logs({'address': self.addresses, 'topics': [self.topics],
+                                         'fromBlock': from_block, 'toBlock': to_block})
+        except (Web3RPCError, ValueError, TimeoutError) as e:
+            if from_block == to_block or not is_log_limit_message(e):
+                raise
+        middle = (from_block + to_block) // 2
+        return self.get_logs(from_block, middle) + self.get_logs(middle + 1, to_block)
+
+    def next_node(self):
+        self.node = (self.node + 1) % len(self.w3s)
+        self.w3 = self.w3s[self.node]
+
+    def find_common_ancestor(self):
+        # Latest stored block whose hash still matches the chain
+        for block_number in sorted(self.block_hashes, reverse=True):
+            if self.get_block_hash(block_number) == self.block_hashes[block_number]:
+                return block_number
+        return None
+
+    def rollback(self, block_number):
+        # Drop the events after block_number and rebuild the live state
+        if block_number < self.confirmed_block:
+            raise ValueError(
+                f"Reorg deeper than {self.confirmations} confirmations at block {block_number}")
+        removed = [item for item in self.pending if item[1]
+                   ['blockNumber'] > block_number]
+        self.pending = [item for item in self.pending if item[1]
+                        ['blockNumber'] <= block_number]
+        self.block_hashes = {number: block_hash for number, block_hash in self.block_hashes.items()
+                             if number <= block_number}
+        self.live = self.confirmed.copy()
+        for contract_name, event in self.pending:
+            self.live.apply(contract_name, event)
+        self.last_block = block_number
+        if self.on_reorg is not None:
+            self.on_reorg(block_number, removed)
+
+    def check_reorg(self):
+        if self.last_block not in self.block_hashes:
+            return False
+        if self.get_block_hash(self.last_block) == self.block_hashes[self.last_block]:
+            return False
+        # The hash of the last confirmed block is stored too, so without a
+        # match the reorg changed a confirmed block
+        ancestor = self.find_common_ancestor()
+        if ancestor is None:
+            raise ValueError(
+                f"Reorg deeper than {self.confirmations} confirmations at block {self.confirmed_block}")
+        self.rollback(ancestor)
+        return True
+
+    def confirm(self, head):
+        # Move the events that are deep enough into the confirmed state
+        confirmed_block = min(head - self.confirmations, self.last_block)
+        if confirmed_block <= self.confirmed_block:
+            return
+        for contract_name, event in self.pending:
+            if event['blockNumber'] <= confirmed_block:
+                self.confirmed.apply(contract_name, event)
+        self.pending = [item for item in self.pending if item[1]
+                        ['blockNumber'] > confirmed_block]
+        if confirmed_block not in self.block_hashes:
+            block_hash = self.get_block_hash(confirmed_block)
+            if block_hash is None:
+                return
+            self.block_hashes[confirmed_block] = block_hash
+        self.block_hashes = {number: block_hash for number, block_hash in self.block_hashes.items()
+                             if number >= confirmed_block}
+        self.confirmed_block = confirmed_block
+
+    def poll(self):
+        # Process the blocks that arrived since the last poll
+        head = self.w3.eth.block_number
+        if head < self.last_block:
+            # A node behind the blocks already processed has neither their
+            # hashes nor their logs, so it cannot tell a reorg apart
+            print(f"Node {self.node} is behind at block {head}, switching nodes")
+            self.next_node()
+            return list()
+        if self.confirmed_block not in self.block_hashes:
+            block_hash = self.get_block_hash(self.confirmed_block)
+            if block_hash is not None:
+                self.block_hashes[self.confirmed_block] = block_hash
+        self.check_reorg()
+        new_events = list()
+        while self.last_block < head:
+            from_block = self.last_block + 1
+            to_block = min(from_block + self.max_range - 1, head)
+            to_block_hash = self.get_block_hash(to_block)
+            # The chain got shorter than head, the next poll starts over
+            if to_block_hash is None:
+                break
+            logs = self.get_logs(from_block, to_block)
+            # A reorg happened while fetching the logs, so fetch them again
+            if self.get_block_hash(to_block) != to_block_hash:
+                continue
+            logs = sorted(logs, key=lambda log: (
+                log['blockNumber'], log['logIndex']))
+            for log in logs:
+                decoded = self.decode_log(log)
+                if decoded is None:
+                    continue
+                self.pending.append(decoded)
+                self.live.apply(*decoded)
+                self.block_hashes[log['blockNumber']] = bytes(
+                    log['blockHash']).hex()
+                new_events.append(decoded)
+            self.block_hashes[to_block] = to_block_hash
+            self.last_block = to_block
+        self.confirm(head)
+        if new_events and self.on_events is not None:
+            self.on_events(new_events, self.live)
+        return new_events
+
+    def run(self, poll_interval=2):
+        while True:
+            try:
+                self.poll()
+            except (TimeoutError, RetriesExhaustedError) as e:
+                print(e)
+                self.next_node()
+            time.sleep(poll_interval)
+
+
+def seed_state(events, decimals=1e18):
+    # Build the state from events already gathered, e.g., the 01a pickles
+    # loaded as {contract_name: {event_name: events}}
+    state = GovernanceState(decimals=decimals)
+    items = [(contract_name, event) for contract_name, contract_events in events.items()
+             for event_list in contract_events.values() for event in event_list]
+    for contract_name, event in sorted(items, key=lambda item: (item[1]['blockNumber'], item[1]['logIndex'])):
+        state.apply(contract_name, event)
+    return state
+
+
+def load_events(events_dir, contract_names, end_block):
+    # Events gathered by the 01a notebook (events_<contract_name>.pkl.gz) up
+    # to end_block, keeping only the ones the state is built from
+    events = dict()
+    for contract_name in contract_names:
+        file_dir = os.path.join(events_dir, 'events_' + contract_name + '.pkl.gz')
+        if not os.path.exists(file_dir):
+            print(f"No events of {contract_name} in {events_dir}")
+            continue
+        with gzip.open(file_dir, 'rb') as f:
+            contract_events = pickle.load(f)
+        events[contract_name] = {event_name: [event for event in event_list if event['blockNumber'] <= end_block]
+                                 for event_name, event_list in contract_events.items() if event_name in applied_events}
+        del contract_events
+    return events
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Follow the chain and print the tallies of open proposals.')
+    parser.add_argument('--eth-node', action='append', required=True,
+                        help='Ethereum node URL (repeat to use several nodes)')
+    parser.add_argument('--start-block', type=int, default=block_max_ethereum + 1,
+                        help='First block to follow, right after the gathered events')
+    parser.add_argument('--events-dir', default=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data')),
+                        help='Directory with the events gathered by the 01a notebook')
+    parser.add_argument('--confirmations', type=int, default=12)
+    parser.add_argument('--poll-interval', type=float, default=2)
+    args = parser.parse_args()
+
+    # One Web3 per node rather than a single pool, so that each poll reads
+    # from a single node (see ChainFollower)
+    w3s = [get_w3(eth_node) for eth_node in args.eth_node]
+    # Only the contracts still in use are followed
+    contracts = {contract_setting['contract_name']: get_contract(
+        w3s[0], contract_setting['contract_address'],
+        abi_contract_address=contract_setting['abi_address'], is_zksync=False)
+        for contract_setting in contract_settings if contract_setting['end'] == block_max_ethereum}
+
+    # The state starts from the gathered events, so proposals created before
+    # start_block are tallied too
+    events = load_events(args.events_dir, [contract_setting['contract_name'] for contract_setting in contract_settings],
+                         end_block=args.start_block - 1)
+    state = seed_state(events)
+    del events
+
+    def print_open_proposals(new_events, state):
+        print(f"{len(new_events)} new events")
+        print(state.get_open_proposals(follower.last_block).to_string())
+
+    def print_reorg(block_number, removed):
+        print(
+            f"Reorg: rolled back to block {block_number}, {len(removed)} events removed")
+
+    follower = ChainFollower(w3s, contracts, start_block=args.start_block, confirmations=args.confirmations,
+                             state=state, on_events=print_open_proposals, on_reorg=print_reorg)
+    follower.run(poll_interval=args.poll_interval)
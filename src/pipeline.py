@@ -0,0 +1,531 @@
+import argparse
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+from ethereum import get_blocks, get_contract
+from rpc_pool import get_w3
+from scheduler import get_all_events_from_contracts
+from settings import block_max_ethereum, contract_settings, label_settings, protocol_settings
+from utils import (drop_truncated_labels, get_etherscan_labels, get_event_parser, event_parsers,
+                   get_monthly_proposals, get_proposal_margins, get_proposal_titles,
+                   get_proposals_created_timestamp, get_proposals_defeated, get_supporters,
+                   get_sybil_list_labels, get_votes_per_proposal, get_votes_weighted,
+                   load_tally_delegates, merge_block_timestamps, persist_dataframe)
+
+label_sources = {'etherscan': get_etherscan_labels,
+                 'sybil_list': get_sybil_list_labels}
+
+
+def get_hash(*values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_file_hash(file_dir, chunk_size=2**20):
+    sha256 = hashlib.sha256()
+    with open(file_dir, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_func_source(func):
+    # Changing the code of a stage invalidates its cached outputs
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return func.__qualname__
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), params=None, file_dir=None, outputs=None, batch=False):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or dict()
+        # Source stages read a file, and their key is the hash of its content
+        self.file_dir = file_dir
+        # Files written by the stage; the stage runs again if any is missing
+        self.outputs = outputs or list()
+        # Batch stages sharing the same func are computed by a single call
+        # func({name: params}, save), which calls save(name, value) for each
+        # stage as soon as its value is ready
+        self.batch = batch
+
+
+class Pipeline:
+    # DAG of stages whose outputs are cached on disk as gzip pickles.
+    # The key of a stage is the hash of its name, code, parameters and the keys
+    # of its dependencies, so keys are known before running anything, and only
+    # the stages whose key is not in the cache (and their missing dependencies)
+    # are computed. Values are only kept in memory until the last stage that
+    # depends on them has run.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.stages = dict()
+        self.keys = dict()
+        self.values = dict()
+        self.refs = dict()
+        self.computed = list()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.file_hashes_dir = os.path.join(cache_dir, 'file_hashes.json')
+        self.file_hashes = dict()
+        if os.path.exists(self.file_hashes_dir):
+            with open(self.file_hashes_dir) as f:
+                self.file_hashes = json.load(f)
+
+    def add_stage(self, name, func, deps=(), params=None, outputs=None, batch=False):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        if batch and deps:
+            raise ValueError(f"Batch stage {name} cannot have dependencies")
+        self.stages[name] = Stage(
+            name, func, deps=deps, params=params, outputs=outputs, batch=batch)
+        return name
+
+    def add_file(self, name, file_dir, loader):
+        self.stages[name] = Stage(name, loader, file_dir=file_dir)
+        return name
+
+    def get_file_hash(self, file_dir):
+        # Hashing large files is slow, so hashes are reused while the size and
+        # modification time of the file do not change
+        stat = os.stat(file_dir)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = self.file_hashes.get(file_dir)
+        if cached is None or cached['signature'] != signature:
+            cached = {'signature': signature,
+                      'hash': get_file_hash(file_dir)}
+            self.file_hashes[file_dir] = cached
+            with open(self.file_hashes_dir, 'w') as f:
+                json.dump(self.file_hashes, f, indent=4)
+        return cached['hash']
+
+    def get_key(self, name):
+        if name not in self.keys:
+            stage = self.stages[name]
+            if stage.file_dir is not None:
+                self.keys[name] = get_hash(
+                    name, self.get_file_hash(stage.file_dir))
+            else:
+                self.keys[name] = get_hash(name, get_func_source(stage.func), stage.params,
+                                           [self.get_key(dep) for dep in stage.deps])
+        return self.keys[name]
+
+    def get_cache_file(self, name):
+        return os.path.join(self.cache_dir, name, self.get_key(name) + '.pkl.gz')
+
+    def is_cached(self, name):
+        stage = self.stages[name]
+        if stage.file_dir is not None:
+            return True
+        if not os.path.exists(self.get_cache_file(name)):
+            return False
+        return all(os.path.exists(file_dir) for file_dir in stage.outputs)
+
+    def save_value(self, name, value):
+        cache_file = self.get_cache_file(name)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with gzip.open(cache_file + '.tmp', 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(cache_file + '.tmp', cache_file)
+        self.computed.append(name)
+
+    def run_batch(self, names):
+        # Compute batch stages sharing the same func with one call
+        stage = self.stages[names[0]]
+        print(f"Running {len(names)} stages in one batch, e.g., {names[0]}")
+        stage.func({name: self.stages[name].params for name in names}, self.save_value)
+        for name in names:
+            if not self.is_cached(name):
+                raise ValueError(f"Batch stage {name} was not saved")
+
+    def get_value(self, name):
+        if name in self.values:
+            return self.values[name]
+        stage = self.stages[name]
+        if stage.file_dir is not None:
+            value = stage.func(stage.file_dir)
+        elif self.is_cached(name):
+            with gzip.open(self.get_cache_file(name), 'rb') as f:
+                value = pickle.load(f)
+        elif stage.batch:
+            self.run_batch([name])
+            return self.get_value(name)
+        else:
+            print(f"Running {name}")
+            value = stage.func(*[self.get_value(dep)
+                               for dep in stage.deps], **stage.params)
+            self.save_value(name, value)
+            for dep in stage.deps:
+                self.release(dep)
+        if self.refs.get(name, 0) > 0:
+            self.values[name] = value
+        return value
+
+    def release(self, name):
+        # Drop the value once every stage that depends on it has run
+        self.refs[name] = self.refs.get(name, 0) - 1
+        if self.refs[name] <= 0:
+            self.values.pop(name, None)
+
+    def get_plan(self, targets):
+        # Stages that must be computed, dependencies first
+        plan = dict()
+
+        def visit(name):
+            if name in plan or self.is_cached(name):
+                return
+            for dep in self.stages[name].deps:
+                visit(dep)
+            plan[name] = True
+
+        for name in targets:
+            visit(name)
+        return list(plan)
+
+    def get_targets(self):
+        # Stages no other stage depends on
+        deps = {dep for stage in self.stages.values() for dep in stage.deps}
+        return [name for name in self.stages if name not in deps]
+
+    def run(self, targets=None):
+        targets = targets or self.get_targets()
+        self.computed = list()
+        plan = self.get_plan(targets)
+        self.refs = dict()
+        for name in plan:
+            for dep in self.stages[name].deps:
+                self.refs[dep] = self.refs.get(dep, 0) + 1
+
+        batches = dict()
+        for name in plan:
+            if self.stages[name].batch:
+                batches.setdefault(self.stages[name].func, list()).append(name)
+        for names in batches.values():
+            self.run_batch(names)
+
+        for name in plan:
+            if not self.stages[name].batch:
+                self.get_value(name)
+        self.values = dict()
+        print("{} stages computed, {} up to date".format(
+            len(self.computed), len(self.stages) - len(self.computed)))
+        return self.computed
+
+
+class ContractLoader:
+    # Connect to the nodes and fetch the ABIs only when events must be gathered
+
+    def __init__(self, eth_nodes, max_workers=20):
+        self.eth_nodes = eth_nodes
+        self.max_workers = max_workers
+        self.w3 = None
+        self.contracts = dict()
+        self.lock = threading.Lock()
+
+    def get_w3(self):
+        with self.lock:
+            if self.w3 is None:
+                self.w3 = get_w3(self.eth_nodes,
+                                 max_concurrency=self.max_workers)
+            return self.w3
+
+    def get_contract(self, contract_setting):
+        w3 = self.get_w3()
+        with self.lock:
+            contract_name = contract_setting['contract_name']
+            if contract_name not in self.contracts:
+                self.contracts[contract_name] = get_contract(
+                    w3, contract_setting['contract_address'],
+                    abi_contract_address=contract_setting['abi_address'], is_zksync=False)
+            return self.contracts[contract_name]
+
+
+def get_partitions(start_block, end_block, partition_size):
+    # Split [start_block, end_block] into (start, end) partitions with
+    # inclusive ends that do not overlap, like get_batch_intervals. They are
+    # aligned to multiples of partition_size, so extending the block range
+    # only changes the last partition and adds new ones.
+    partitions = list()
+    block_number = start_block
+    while block_number <= end_block:
+        partition_end = min(
+            (block_number // partition_size + 1) * partition_size - 1, end_block)
+        partitions.append((block_number, partition_end))
+        block_number = partition_end + 1
+    return partitions
+
+
+def load_blocks(file_dir):
+    blocks_df = pd.read_csv(file_dir, compression='gzip')
+    blocks_df['timestamp'] = pd.to_datetime(
+        blocks_df['timestamp']).dt.tz_localize(None)
+    return blocks_df
+
+
+def get_last_block(blocks_df):
+    return int(blocks_df['number'].max())
+
+
+def get_block_timestamps(start_block, end_block, w3, max_workers=20):
+    # Timestamps of the blocks in [start_block, end_block]
+    blocks = get_blocks(w3, block_numbers=range(start_block, end_block + 1),
+                        max_workers=max_workers)
+    blocks_df = pd.DataFrame({'number': [block['number'] for block in blocks],
+                              'timestamp': [block['timestamp'] for block in blocks]})
+    blocks_df['timestamp'] = pd.to_datetime(
+        blocks_df['timestamp'], unit='s')
+    return blocks_df
+
+
+def concat_blocks(*partitions):
+    if not partitions:
+        return pd.DataFrame(columns=['number', 'timestamp'])
+    return pd.concat(partitions, ignore_index=True)
+
+
+def parse_events(events):
+    # Convert the events of one partition to one dataframe per event
+    return {event_name: get_event_parser(event_name)(event_list)
+            for event_name, event_list in events.items() if event_name in event_parsers and event_list}
+
+
+def concat_partitions(*partitions):
+    tables = dict()
+    for partition in partitions:
+        for event_name, df in partition.items():
+            tables.setdefault(event_name, list()).append(df)
+    return {event_name: pd.concat(dfs, ignore_index=True) for event_name, dfs in tables.items()}
+
+
+def concat_governors(governor_tables, governors, event_name):
+    dfs = list()
+    for contract_name, label in governors.items():
+        df = governor_tables[contract_name].get(event_name)
+        if df is None:
+            continue
+        df = df.copy()
+        if label is not None:
+            df['governor'] = label
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=['proposalId', 'blockNumber', 'transactionIndex'])
+    return pd.concat(dfs, ignore_index=True)
+
+
+def build_protocol_datasets(blocks_df, missing_blocks_df, *tables, governors, title_fixes, token):
+    # Reproduces the parsing of the 02 notebook for one protocol
+    if not missing_blocks_df.empty:
+        blocks_df = pd.concat([blocks_df, missing_blocks_df], ignore_index=True)
+    governor_tables = dict(zip(governors, tables))
+    datasets = dict()
+
+    votes_df = concat_governors(governor_tables, governors, 'VoteCast').sort_values(
+        by=['blockNumber', 'transactionIndex', 'proposalId'])
+    datasets['votes_df'] = merge_block_timestamps(votes_df, blocks_df)
+
+    proposal_created_df = concat_governors(governor_tables, governors, 'ProposalCreated').sort_values(
+        by=['blockNumber', 'transactionIndex', 'proposalId'])
+    proposal_created_df = get_proposal_titles(proposal_created_df)
+    datasets['proposal_created_df'] = merge_block_timestamps(
+        proposal_created_df, blocks_df)
+
+    # Some proposals have two cancel transactions, only the first one is kept
+    proposal_cancelled_df = concat_governors(governor_tables, governors, 'ProposalCanceled').sort_values(
+        by='proposalId').groupby('proposalId').first().reset_index()
+    datasets['proposal_cancelled_df'] = merge_block_timestamps(
+        proposal_cancelled_df, blocks_df)
+
+    proposal_executed_df = concat_governors(
+        governor_tables, governors, 'ProposalExecuted').sort_values(by='proposalId')
+    datasets['proposal_executed_df'] = merge_block_timestamps(
+        proposal_executed_df, blocks_df)
+
+    proposals_queued_df = concat_governors(
+        governor_tables, governors, 'ProposalQueued').sort_values(by='proposalId')
+    datasets['proposals_queued_df'] = merge_block_timestamps(
+        proposals_queued_df, blocks_df)
+
+    for event_name, filename in [('VotingDelaySet', 'proposal_voting_delay_df'),
+                                 ('VotingPeriodSet', 'proposal_voting_period_df')]:
+        df = concat_governors(governor_tables, governors, event_name)
+        if not df.empty:
+            datasets[filename] = merge_block_timestamps(df, blocks_df)
+
+    supporters_df = get_supporters(votes_df)
+    votes_weighted_df = get_votes_weighted(votes_df, supporters_df, datasets['proposal_created_df'],
+                                           proposal_cancelled_df, proposal_executed_df,
+                                           proposals_queued_df, blocks_df, title_fixes=title_fixes)
+    datasets['supporters_df'] = supporters_df.reset_index()
+    datasets['votes_weighted_df'] = votes_weighted_df
+
+    token_tables = tables[len(governors)] if token is not None else dict()
+    for event_name, df in token_tables.items():
+        datasets[event_name.lower() + '_df'] = df
+    return datasets
+
+
+def build_protocol_eda(datasets, min_votes=1e-3):
+    # Aggregates behind the plots of the 03c notebook for one protocol
+    votes_weighted_df = datasets['votes_weighted_df']
+    proposals_defeated_df = get_proposals_defeated(votes_weighted_df)
+    proposals_created_timestamp_df = get_proposals_created_timestamp(
+        votes_weighted_df)
+    votes_per_proposal_df = get_votes_per_proposal(
+        datasets['votes_df'], proposals_defeated_df, min_votes=min_votes)
+    votes_per_proposal_df.columns = ['_'.join(column)
+                                     for column in votes_per_proposal_df.columns]
+    return {'proposals_defeated_df': proposals_defeated_df,
+            'proposals_created_timestamp_df': proposals_created_timestamp_df,
+            'monthly_proposals_df': get_monthly_proposals(proposals_created_timestamp_df).reset_index(),
+            'votes_per_proposal_df': votes_per_proposal_df.reset_index(),
+            'proposal_margins_df': get_proposal_margins(votes_weighted_df).reset_index()}
+
+
+def persist_datasets(datasets, path_dir):
+    return [persist_dataframe(path_dir, df, filename + '.csv.gz')
+            for filename, df in datasets.items()]
+
+
+def persist_labels(*labels_dfs, path_dir, filenames):
+    return persist_datasets(dict(zip(filenames, labels_dfs)), path_dir)
+
+
+def build_governance_pipeline(data_dir, cache_dir, eth_nodes, blocks_file, end_block=block_max_ethereum,
+                              partition_size=100_000, max_workers=20, settings=contract_settings,
+                              protocols=protocol_settings, labels=label_settings):
+    # Gathering of the events (01a) and account labels (01c), parsing (02),
+    # and the datasets and aggregates used by the EDA (03c)
+    pipeline = Pipeline(cache_dir)
+    loader = ContractLoader(eth_nodes, max_workers=max_workers)
+    blocks = pipeline.add_file('blocks', blocks_file, load_blocks)
+
+    def gather_missing_blocks(start_block, end_block):
+        return get_block_timestamps(start_block, end_block, loader.get_w3(), max_workers=max_workers)
+
+    # The timestamps past the blocks file are fetched in partitions like the
+    # events, so extending end_block only fetches the last and new ones. The
+    # end of the blocks file is cached by file hash, so the large CSV is only
+    # read when it changes.
+    blocks_end = pipeline.get_value(pipeline.add_stage(
+        'blocks-end', get_last_block, deps=[blocks]))
+    missing_partitions = [pipeline.add_stage(f'missing-blocks/{start_block}-{partition_end}', gather_missing_blocks,
+                                             params={'start_block': start_block, 'end_block': partition_end})
+                          for start_block, partition_end in get_partitions(blocks_end + 1, end_block, partition_size)]
+    missing_blocks = pipeline.add_stage(
+        'missing-blocks', concat_blocks, deps=missing_partitions)
+
+    def gather_events(partitions, save):
+        # All the partitions to gather go through one scheduler run, keyed by
+        # stage name, and each one is cached as soon as it is complete
+        contracts = dict()
+        partition_settings = list()
+        for name, params in partitions.items():
+            contract_setting = next(contract_setting for contract_setting in settings
+                                    if contract_setting['contract_name'] == params['contract_name'])
+            contracts[name] = loader.get_contract(contract_setting)
+            partition_settings.append(dict(contract_setting, contract_name=name, start=params['start_block'],
+                                           end=params['end_block'], batch_size=params['batch_size'],
+                                           events=params['events']))
+        get_all_events_from_contracts(contracts, partition_settings, max_workers=max_workers,
+                                      callback=save)
+        # Partitions without any interval to gather never reach the callback
+        for name in partitions:
+            if not pipeline.is_cached(name):
+                save(name, dict())
+
+    tables = dict()
+    for contract_setting in settings:
+        contract_name = contract_setting['contract_name']
+        batch_size = 2500 if not 'token' in contract_name else 50
+        # Contracts still in use follow end_block, the others stop at their own end
+        contract_end = end_block if contract_setting['end'] == block_max_ethereum else min(
+            contract_setting['end'], end_block)
+        parsed = list()
+        for start_block, partition_end in get_partitions(contract_setting['start'], contract_end, partition_size):
+            partition = f'{start_block}-{partition_end}'
+            events = pipeline.add_stage(f'events/{contract_name}/{partition}', gather_events,
+                                        params={'contract_name': contract_name, 'start_block': start_block,
+                                                'end_block': partition_end, 'batch_size': batch_size,
+                                                'events': contract_setting['events']}, batch=True)
+            parsed.append(pipeline.add_stage(
+                f'parsed/{contract_name}/{partition}', parse_events, deps=[events]))
+        tables[contract_name] = pipeline.add_stage(
+            f'tables/{contract_name}', concat_partitions, deps=parsed)
+
+    for protocol_name, protocol in protocols.items():
+        deps = [blocks, missing_blocks] + [tables[contract_name]
+                                           for contract_name in protocol['governors']]
+        if protocol['token'] is not None:
+            deps.append(tables[protocol['token']])
+        datasets = pipeline.add_stage(f'datasets/{protocol_name}', build_protocol_datasets, deps=deps,
+                                      params={'governors': protocol['governors'],
+                                              'title_fixes': protocol['title_fixes'],
+                                              'token': protocol['token']})
+        path_dir = os.path.join(data_dir, protocol_name)
+        pipeline.add_stage(f'csv/{protocol_name}', persist_datasets, deps=[datasets], params={'path_dir': path_dir},
+                           outputs=[os.path.join(path_dir, filename) for filename in ['votes_df.csv.gz', 'votes_weighted_df.csv.gz']])
+        # Kept out of the protocol directory, which 03c loads as a whole
+        eda = pipeline.add_stage(
+            f'eda/{protocol_name}', build_protocol_eda, deps=[datasets])
+        eda_dir = os.path.join(data_dir, 'eda', protocol_name)
+        pipeline.add_stage(f'csv/eda/{protocol_name}', persist_datasets, deps=[eda], params={'path_dir': eda_dir},
+                           outputs=[os.path.join(eda_dir, 'proposals_defeated_df.csv.gz')])
+
+    # The remote label lists are snapshots cached by URL, delete their cache
+    # to fetch them again. The Tally delegates pages are saved by hand in
+    # data/labels, and only parsed when present.
+    label_stages = [pipeline.add_stage(f'labels/{label_name}', label_sources[label_name], params={'url': url})
+                    for label_name, url in labels.items()]
+    label_names = list(labels)
+    labels_dir = os.path.join(data_dir, 'labels')
+    for protocol_name in protocols:
+        file_dir = os.path.join(
+            labels_dir, f'Tally _ {protocol_name.capitalize()} _ Delegates.html')
+        if not os.path.exists(file_dir):
+            continue
+        tally = pipeline.add_file(
+            f'tally/{protocol_name}', file_dir, load_tally_delegates)
+        label_stages.append(pipeline.add_stage(
+            f'labels/tally_{protocol_name}', drop_truncated_labels, deps=[tally]))
+        label_names.append(f'tally_{protocol_name}')
+    if label_stages:
+        filenames = [f'{label_name}_account_labels' for label_name in label_names]
+        pipeline.add_stage('csv/labels', persist_labels, deps=label_stages,
+                           params={'path_dir': labels_dir, 'filenames': filenames},
+                           outputs=[os.path.join(labels_dir, filename + '.csv.gz') for filename in filenames])
+    return pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Gather and parse the governance datasets, recomputing only what changed.')
+    parser.add_argument('--eth-node', action='append', required=True,
+                        help='Ethereum archive node URL (repeat to use several nodes)')
+    parser.add_argument('--data-dir', default=os.path.realpath(
+        os.path.join(os.path.dirname(__file__), '..', 'data')))
+    parser.add_argument('--cache-dir', default=None,
+                        help='Defaults to <data-dir>/cache')
+    parser.add_argument('--blocks-file', default=None,
+                        help='Block timestamps CSV from the 01b notebook')
+    parser.add_argument('--end-block', type=int, default=block_max_ethereum)
+    parser.add_argument('--partition-size', type=int, default=100_000)
+    parser.add_argument('--max-workers', type=int, default=20)
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or os.path.join(args.data_dir, 'cache')
+    blocks_file = args.blocks_file or os.path.join(
+        args.data_dir, 'blocks', 'block_timestamp__9600000_20563001.csv.gz')
+    pipeline = build_governance_pipeline(args.data_dir, cache_dir, args.eth_node, blocks_file,
+                                         end_block=args.end_block, partition_size=args.partition_size,
+                                         max_workers=args.max_workers)
+    pipeline.run()
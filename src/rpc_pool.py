@@ -0,0 +1,262 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from web3 import Web3
+from web3.providers import JSONBaseProvider
+
+# JSON-RPC error codes and messages that nodes use to signal rate limiting
+RATE_LIMIT_CODES = {-32005, -32029, 429}
+RATE_LIMIT_MESSAGES = ('rate limit', 'too many requests', 'over capacity')
+# Messages of deterministic errors that some nodes send with a rate-limit code,
+# e.g., Infura's -32005 "query returned more than 10000 results". Retrying
+# them cannot succeed, so they are returned to web3 unchanged.
+LOG_LIMIT_MESSAGES = ('more than', 'too many results', 'response size',
+                      'limited to', 'range is too', 'block range')
+
+# Methods that change the chain state must never be duplicated by hedging
+NON_IDEMPOTENT_METHODS = {'eth_sendRawTransaction', 'eth_sendTransaction'}
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class RetriesExhaustedError(Exception):
+    # Raised once the pool has retried a request max_retries times. It is not
+    # a TimeoutError, so the retry loops of ethereum.py do not retry it again.
+    pass
+
+
+class Endpoint:
+    # Keeps the observed latency and circuit breaker state of one RPC node
+
+    def __init__(self, url, max_concurrency=20, timeout=60, latency=1.0):
+        self.url = url
+        self.timeout = timeout
+        self.latency = latency
+        self.inflight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.half_open = False
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __repr__(self):
+        return 'Endpoint({}, latency={:.3f}s, failures={})'.format(
+            self.url, self.latency, self.failures)
+
+
+class RPCPool(JSONBaseProvider):
+    # Web3 provider that spreads requests across several RPC endpoints.
+    # Endpoints are picked at random, weighted by the inverse of their
+    # observed (EWMA) latency. Requests slower than the `hedge_percentile`
+    # of recent latencies of the same method are duplicated on a second
+    # endpoint and the first answer wins. Rate-limit errors are retried with
+    # jittered exponential backoff, and endpoints failing `failure_threshold`
+    # times in a row are skipped for `cooldown` seconds (circuit breaker)
+    # before a single probe request is let through. Rate limits do not count
+    # as failures: the node is up, and opening its circuit would stop a pool
+    # of rate-limited nodes for the whole cooldown.
+
+    def __init__(self, endpoints, max_concurrency=20, timeout=60,
+                 max_retries=8, backoff_base=0.25, backoff_max=16.0,
+                 hedge_delay=None, hedge_percentile=0.95, failure_threshold=5,
+                 cooldown=30.0, ewma_alpha=0.2, hedge_min_samples=20, **kwargs):
+        super().__init__(**kwargs)
+        if not endpoints:
+            raise ValueError('At least one endpoint is required')
+        self.endpoints = [Endpoint(url, max_concurrency=max_concurrency, timeout=timeout)
+                          for url in endpoints]
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # A fixed hedge delay in seconds, or None to derive it from the
+        # latencies of the last 1000 successful requests of the same method.
+        # A method is not hedged until it has hedge_min_samples latencies,
+        # since eth_getLogs and eth_getBlockByNumber differ by orders of
+        # magnitude.
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = dict()
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+        self.lock = threading.Lock()
+        self.hedge_pool = ThreadPoolExecutor(
+            max_workers=2 * max_concurrency * len(self.endpoints))
+
+    def __repr__(self):
+        return 'RPCPool({})'.format([endpoint.url for endpoint in self.endpoints])
+
+    def is_available(self, endpoint, now):
+        # Closed circuits are available. Open circuits become half-open after
+        # the cooldown, which lets exactly one probe request through.
+        if endpoint.open_until == 0.0:
+            return True
+        if now >= endpoint.open_until and not endpoint.half_open:
+            return True
+        return False
+
+    def select_endpoint(self, exclude=()):
+        with self.lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude and self.is_available(endpoint, now)]
+            if not candidates:
+                return None
+            weights = [1 / (max(endpoint.latency, 1e-3) * (1 + endpoint.inflight))
+                       for endpoint in candidates]
+            endpoint = random.choices(candidates, weights=weights)[0]
+            if endpoint.open_until != 0.0:
+                endpoint.half_open = True
+            endpoint.inflight += 1
+            return endpoint
+
+    def record_success(self, endpoint, method, latency):
+        with self.lock:
+            endpoint.inflight -= 1
+            endpoint.latency = (1 - self.ewma_alpha) * \
+                endpoint.latency + self.ewma_alpha * latency
+            endpoint.failures = 0
+            self.latencies.setdefault(method, deque(maxlen=1000)).append(latency)
+            endpoint.open_until = 0.0
+            endpoint.half_open = False
+
+    def record_failure(self, endpoint, penalty=None):
+        with self.lock:
+            endpoint.inflight -= 1
+            endpoint.failures += 1
+            if penalty is not None:
+                endpoint.latency = (1 - self.ewma_alpha) * \
+                    endpoint.latency + self.ewma_alpha * penalty
+            if endpoint.half_open or endpoint.failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+                endpoint.half_open = False
+
+    def record_rate_limit(self, endpoint):
+        with self.lock:
+            endpoint.inflight -= 1
+
+    def get_backoff(self, attempt):
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get_hedge_delay(self, method):
+        # None means the request is not hedged
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self.lock:
+            latencies = sorted(self.latencies.get(method, ()))
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return latencies[int(self.hedge_percentile * (len(latencies) - 1))]
+
+    def send(self, endpoint, method, request_data):
+        # Send one request to one endpoint and update its statistics. The
+        # latency is measured once a slot is acquired, so time spent queuing
+        # behind our own requests is not blamed on the node.
+        try:
+            with endpoint.semaphore:
+                start = time.monotonic()
+                rq = endpoint.session.post(endpoint.url, data=request_data,
+                                           headers={'Content-Type': 'application/json'},
+                                           timeout=endpoint.timeout)
+                latency = time.monotonic() - start
+            if rq.status_code == 429:
+                raise RateLimitError('HTTP 429 from {}'.format(endpoint.url))
+            rq.raise_for_status()
+            response = self.decode_rpc_response(rq.content)
+            if is_rate_limit_response(response):
+                raise RateLimitError(
+                    'Rate limited by {}: {}'.format(endpoint.url, response['error']))
+        except RateLimitError:
+            self.record_rate_limit(endpoint)
+            raise
+        except (requests.RequestException, ValueError):
+            self.record_failure(endpoint, penalty=endpoint.timeout)
+            raise
+        self.record_success(endpoint, method, latency)
+        return response
+
+    def send_hedged(self, method, request_data):
+        # Send to the best endpoint and, if it is slower than the hedge delay,
+        # race it against a duplicate sent to a different endpoint
+        endpoint = self.select_endpoint()
+        if endpoint is None:
+            raise ConnectionError('All RPC endpoints are unavailable')
+        futures = {self.hedge_pool.submit(
+            self.send, endpoint, method, request_data)}
+        hedge_delay = self.get_hedge_delay(method)
+        if method in NON_IDEMPOTENT_METHODS or len(self.endpoints) == 1 or hedge_delay is None:
+            return futures.pop().result()
+
+        done, pending = wait(futures, timeout=hedge_delay)
+        if not done:
+            hedge_endpoint = self.select_endpoint(exclude=(endpoint,))
+            if hedge_endpoint is not None:
+                pending.add(self.hedge_pool.submit(
+                    self.send, hedge_endpoint, method, request_data))
+
+        error = None
+        while pending or done:
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        raise error
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                return self.send_hedged(method, request_data)
+            except (RateLimitError, ConnectionError, requests.RequestException, ValueError) as e:
+                error = e
+                time.sleep(self.get_backoff(attempt))
+        raise RetriesExhaustedError(
+            'Error: Cannot get a response for {} ({})'.format(method, error))
+
+    def get_stats(self):
+        return [{'url': endpoint.url, 'latency': endpoint.latency, 'inflight': endpoint.inflight,
+                 'failures': endpoint.failures, 'open': endpoint.open_until > time.monotonic()}
+                for endpoint in self.endpoints]
+
+
+def is_rate_limit_response(response):
+    if not isinstance(response, dict) or 'error' not in response:
+        return False
+    error = response['error']
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get('message', '')).lower()
+    if is_log_limit_message(message):
+        return False
+    if error.get('code') in RATE_LIMIT_CODES:
+        return True
+    return any(text in message for text in RATE_LIMIT_MESSAGES)
+
+
+def is_log_limit_message(message):
+    message = str(message).lower()
+    return any(text in message for text in LOG_LIMIT_MESSAGES)
+
+
+def get_w3(endpoints, **kwargs):
+    # Connect to several Ethereum nodes through a single Web3 object
+    if isinstance(endpoints, str):
+        endpoints = [endpoints]
+    return Web3(RPCPool(endpoints, **kwargs))
@@ -0,0 +1,174 @@
+import gzip
+import itertools
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
+
+from tqdm.notebook import tqdm
+
+from ethereum import get_batch_intervals, get_events_from_contract
+
+
+def is_token_contract(contract_name):
+    return 'token' in contract_name
+
+
+def get_work_items(contracts, contract_settings, batch_size=5000):
+    # Build one (priority, seq, contract_name, event_name, start, end) work item
+    # per contract event and block interval of the whole config.
+    # Governor contracts have few events and come first. Token contracts are
+    # much larger, so their intervals are interleaved round-robin across all
+    # token events to keep every stream moving until the end of the crawl.
+    work_items = list()
+    token_streams = list()
+    seq = itertools.count()
+    for contract_setting in contract_settings:
+        contract_name = contract_setting['contract_name']
+        contract = contracts[contract_name]
+        events = contract_setting.get('events') or [
+            event.event_name for event in contract.events]
+        intervals = get_batch_intervals(
+            block_start=contract_setting['start'], block_end=contract_setting['end'],
+            batch_size=contract_setting.get('batch_size', batch_size))
+        for event_name in events:
+            items = [(contract_name, event_name, *interval)
+                     for interval in intervals]
+            if is_token_contract(contract_name):
+                token_streams.append(items)
+            else:
+                work_items += [(0, next(seq), *item) for item in items]
+    for items in itertools.zip_longest(*token_streams):
+        work_items += [(1, next(seq), *item)
+                       for item in items if item is not None]
+    return work_items
+
+
+def bind_contracts(w3, contracts):
+    # Create copies of the contracts that send their requests through w3
+    return {contract_name: w3.eth.contract(address=contract.address, abi=contract.abi)
+            for contract_name, contract in contracts.items()}
+
+
+def spill_batch(spill_dir, seq, events):
+    file_dir = os.path.join(spill_dir, f'{seq}.pkl.gz')
+    with gzip.open(file_dir, 'wb') as f:
+        pickle.dump(events, f)
+    return file_dir
+
+
+def load_batch(batch):
+    # Batches are either the events or the file they were spilled to
+    if not isinstance(batch, str):
+        return batch
+    with gzip.open(batch, 'rb') as f:
+        events = pickle.load(f)
+    os.remove(batch)
+    return events
+
+
+def get_all_events_from_contracts(contracts, contract_settings, endpoints=None, max_workers=20,
+                                  batch_size=5000, callback=None, spill_dir=None):
+    # Gather the events of every contract in contract_settings through a single
+    # bounded worker pool. endpoints is a list of (w3, max_workers) pairs giving
+    # the concurrency budget of each node; by default the contracts' own w3 is
+    # used with max_workers threads. callback(contract_name, events) is called
+    # as soon as all the intervals of a contract are done; the events are then
+    # dropped and only the number of events of each contract is returned.
+    # Without a callback the events of every contract are returned.
+    # With a callback, finished batches are spilled to gzip pickles in
+    # spill_dir (a temporary directory by default) and only read back when
+    # their contract is done, one contract at a time. Token streams are
+    # interleaved until the end of the crawl, so keeping their batches in
+    # memory would hold every token history at once.
+    work_items = get_work_items(
+        contracts, contract_settings, batch_size=batch_size)
+    work_queue = queue.PriorityQueue()
+    for work_item in work_items:
+        work_queue.put(work_item)
+
+    if endpoints is None:
+        endpoints = [(None, max_workers)]
+    workers_contracts = [(contracts if w3 is None else bind_contracts(w3, contracts), budget)
+                         for w3, budget in endpoints]
+
+    results = {contract_setting['contract_name']: dict()
+               for contract_setting in contract_settings}
+    remaining = {contract_name: 0 for contract_name in results}
+    for work_item in work_items:
+        remaining[work_item[2]] += 1
+    counts = dict()
+    lock = threading.Lock()
+    callback_lock = threading.Lock()
+    remove_spill_dir = False
+    if callback is not None and spill_dir is None:
+        spill_dir = tempfile.mkdtemp(prefix='events_')
+        remove_spill_dir = True
+    elif spill_dir is not None:
+        os.makedirs(spill_dir, exist_ok=True)
+    errors = list()
+    progress = tqdm(total=len(work_items), desc='Gathering events')
+
+    def worker(worker_contracts):
+        while not errors:
+            try:
+                _, seq, contract_name, event_name, start_block, end_block = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                events = get_events_from_contract({
+                    'contract_event_function': worker_contracts[contract_name].events[event_name],
+                    'start_block': start_block,
+                    'end_block': end_block})
+                if callback is not None:
+                    events = spill_batch(spill_dir, seq, events)
+            except Exception as e:
+                errors.append(e)
+                return
+            with lock:
+                results[contract_name].setdefault(
+                    event_name, list()).append((start_block, events))
+                remaining[contract_name] -= 1
+                is_done = remaining[contract_name] == 0
+                progress.update(1)
+            if is_done and callback is not None:
+                with lock:
+                    contract_batches = results.pop(contract_name)
+                with callback_lock:
+                    try:
+                        contract_events = merge_batches(contract_batches)
+                        callback(contract_name, contract_events)
+                    except Exception as e:
+                        errors.append(e)
+                        return
+                    with lock:
+                        counts[contract_name] = {event_name: len(events)
+                                                 for event_name, events in contract_events.items()}
+                    del contract_events
+
+    threads = [threading.Thread(target=worker, args=(worker_contracts,))
+               for worker_contracts, budget in workers_contracts for _ in range(budget)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.close()
+    if remove_spill_dir:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    if errors:
+        raise errors[0]
+
+    if callback is not None:
+        return counts
+    return {contract_name: merge_batches(contract_events)
+            for contract_name, contract_events in results.items()}
+
+
+def merge_batches(contract_events):
+    # Put the batches of each event back in block order, reading the spilled
+    # ones back from disk
+    return {event_name: list(itertools.chain.from_iterable(load_batch(events) for _, events in
+                                                           sorted(batches, key=lambda batch: batch[0])))
+            for event_name, batches in contract_events.items()}
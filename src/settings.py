@@ -0,0 +1,77 @@
+from ethereum import to_checksum_address
+
+block_max_ethereum = 20_563_000+1
+
+contract_settings = [
+    # Compound contracts
+    {
+        'contract_name': 'compound-governor-alpha',
+        'contract_address': to_checksum_address('0xc0da01a04c3f3e0be433606045bb7017a7323e38'),
+        'abi_address': None,
+        'start': 9_601_459-1,
+        'end': block_max_ethereum,
+        'events': None},
+    {
+        'contract_name': 'compound-governor-bravo',
+        'contract_address': to_checksum_address('0xc0da02939e1441f497fd74f78ce7decb17b66529'),
+        'abi_address': None,
+        'start': 12_006_099-1,
+        'end': block_max_ethereum,
+        'events': None},
+    {
+        'contract_name': 'compound-token',
+        'contract_address': to_checksum_address('0xc00e94cb662c3520282e6f5717214004a7f26888'),
+        'abi_address': None,
+        'start': 9_601_359-1,
+        'end': block_max_ethereum,
+        'events': None},
+
+    # Uniswap contracts
+    {
+        'contract_name': 'uniswap-governor-alpha-1',
+        'contract_address': to_checksum_address('0xc4e172459f1e7939d522503b81afaac1014ce6f6'),
+        'abi_address': None,
+        'start': 12_543_659-1,
+        'end': 13_059_342,
+        'events': None},
+    {
+        'contract_name': 'uniswap-governor-alpha-2',
+        'contract_address': to_checksum_address('0xc4e172459f1e7939d522503b81afaac1014ce6f6'),
+        'abi_address': None,
+        'start': 13_059_344-1,
+        'end': block_max_ethereum,
+        'events': None},
+    {
+        'contract_name': 'uniswap-governor-bravo',
+        'contract_address': to_checksum_address('0x408ed6354d4973f66138c91495f2f2fcbd8724c3'),
+        'abi_address': None,
+        'start': 13_059_157-1,
+        'end': block_max_ethereum,
+        'events': None},
+    {
+        'contract_name': 'uniswap-token',
+        'contract_address': to_checksum_address('0x1f9840a85d5af5bf1d1762f925bdaddc4201f984'),
+        'abi_address': None,
+        'start': 10_861_674-1,
+        'end': block_max_ethereum,
+        'events': None},
+]
+
+# Contracts whose events end up in the parsed governance datasets (02 notebook).
+# Governors map to the label stored in the 'governor' column, or None when the
+# protocol has a single governor and the column is not added.
+protocol_settings = {
+    'compound': {
+        'governors': {'compound-governor-alpha': 'alpha', 'compound-governor-bravo': 'bravo'},
+        'token': 'compound-token',
+        'title_fixes': {116: "Initialize Compound III (USDC on Ethereum)"}},
+    'uniswap': {
+        'governors': {'uniswap-governor-bravo': None},
+        'token': 'uniswap-token',
+        'title_fixes': {}},
+}
+
+label_settings = {
+    'etherscan': 'https://raw.githubusercontent.com/johnnatan-messias/etherscan-labels/main/data/etherscan/combined/combinedAllLabels.json',
+    'sybil_list': 'https://raw.githubusercontent.com/Uniswap/sybil-list/master/verified.json',
+}
@@ -1,6 +1,8 @@
 from tqdm import tqdm
 import os
+import re
 import pandas as pd
+import requests
 
 
 def parse_common_attributes(event):
@@ -224,15 +226,248 @@ def voting_period_set_to_dataframe(events):
     return pd.DataFrame(df)
 
 
+event_parsers = {
+    'Approval': approval_to_dataframe,
+    'DelegateChanged': delegate_changed_to_dataframe,
+    'DelegateVotesChanged': delegate_votes_changed_to_dataframe,
+    'Transfer': transfer_to_dataframe,
+    'MinterChanged': minter_changed_to_dataframe,
+    'ProposalExecuted': proposal_executed_to_dataframe,
+    'ProposalQueued': proposal_queued_to_dataframe,
+    'ProposalCanceled': proposal_cancelled_to_dataframe,
+    'ProposalVotingDelay': proposal_voting_delay_to_dataframe,
+    'VotingPeriodSet': voting_period_set_to_dataframe,
+    'ProposalCreated': proposal_created_to_dataframe,
+    'VoteCast': vote_cast_to_dataframe,
+    'NewImplementation': new_implementation_to_dataframe,
+    'ProposalThresholdSet': proposal_threshold_set_to_dataframe,
+    'VotingDelaySet': voting_delay_set_to_dataframe,
+}
+
+
+def get_event_parser(event_name):
+    # Get the function that converts the events data to a dataframe
+    if event_name not in event_parsers:
+        raise ValueError(f"Event {event_name} not recognized")
+    return event_parsers[event_name]
+
+
+def merge_block_timestamps(df, blocks_df, on='blockNumber'):
+    # Add the block timestamp to each row of the dataframe
+    return df.merge(blocks_df, left_on=on, right_on='number', how='left')
+
+
+def get_proposal_titles(proposal_created_df):
+    # Keep the first line of the description as the proposal title
+    proposal_created_df = proposal_created_df.copy()
+    proposal_created_df['proposal_title'] = proposal_created_df.description.str.split(
+        '\n').apply(lambda x: x[0].replace('#', '').strip())
+    return proposal_created_df.drop(columns=['description'])
+
+
+def get_supporters(votes_df):
+    # Number of voters against, in favor and abstaining on each proposal
+    supporters_df = votes_df.groupby(
+        'proposalId').support.value_counts().unstack(fill_value=0).rename(columns={0: 'against', 1: 'in_favor', 2: 'abstain'})
+    supporters_df['n_votes'] = supporters_df.sum(axis=1)
+    supporters_df['against_percentage'] = 100 * \
+        (supporters_df['against'] / supporters_df['n_votes'])
+    supporters_df['in_favor_percentage'] = 100 * \
+        (supporters_df['in_favor'] / supporters_df['n_votes'])
+    supporters_df['abstain_percentage'] = 100 * \
+        (supporters_df['abstain'] / supporters_df['n_votes'])
+    supporters_df.columns = ['supporter_' +
+                             str(col) for col in supporters_df.columns]
+    return supporters_df
+
+
+def get_votes_weighted(votes_df, supporters_df, proposal_created_df, proposal_cancelled_df,
+                       proposal_executed_df, proposals_queued_df, blocks_df, title_fixes=None):
+    # Votes weighted by voting power and final status of each proposal.
+    # title_fixes maps proposal ids to titles that replace the parsed ones.
+    votes_weighted_df = votes_df.groupby(
+        ['proposalId', 'support']).votes.sum().unstack().fillna(0)
+    votes_weighted_df.rename(
+        columns={0: 'against', 1: 'in_favor', 2: 'abstain'}, inplace=True)
+    votes_weighted_df['n_votes'] = votes_weighted_df.sum(axis=1)
+    votes_weighted_df['against_percentage'] = 100 * (votes_weighted_df['against'] /
+                                                     votes_weighted_df['n_votes'])
+    votes_weighted_df['in_favor_percentage'] = 100 * (votes_weighted_df['in_favor'] /
+                                                      votes_weighted_df['n_votes'])
+    votes_weighted_df['abstain_percentage'] = 100 * (votes_weighted_df['abstain'] /
+                                                     votes_weighted_df['n_votes'])
+
+    votes_weighted_df = votes_weighted_df.merge(
+        supporters_df, how='left', left_on='proposalId', right_on='proposalId')
+
+    votes_weighted_df = votes_weighted_df.merge(proposal_created_df[['proposalId', 'proposer', 'blockNumber', 'transactionHash', 'proposal_title']], how='outer',
+                                                left_on='proposalId', right_on='proposalId')
+
+    for proposal_id, title in (title_fixes or dict()).items():
+        votes_weighted_df.loc[votes_weighted_df['proposalId']
+                              == proposal_id, 'proposal_title'] = title
+
+    cancelled_ids = proposal_created_df.proposalId.isin(
+        proposal_cancelled_df.proposalId)
+    votes_weighted_df = votes_weighted_df.merge(proposal_created_df[cancelled_ids][['proposalId']],
+                                                on='proposalId', how='outer').fillna(0).sort_values(by='proposalId', ascending=True)[votes_weighted_df.columns]
+
+    is_executed = votes_weighted_df['proposalId'].isin(
+        proposal_executed_df.proposalId)
+    is_queued = votes_weighted_df['proposalId'].isin(
+        proposals_queued_df.proposalId)
+    is_cancelled = votes_weighted_df['proposalId'].isin(
+        proposal_cancelled_df.proposalId)
+
+    votes_weighted_df.loc[is_executed, 'status'] = 'executed'
+    votes_weighted_df.loc[is_queued, 'status'] = 'executed'
+    votes_weighted_df.loc[~(is_executed | is_queued | is_cancelled),
+                          'status'] = 'defeated'
+    votes_weighted_df.loc[is_cancelled, 'status'] = 'canceled'
+
+    votes_weighted_df['blockNumber'] = votes_weighted_df['blockNumber'].astype(
+        int)
+
+    return merge_block_timestamps(votes_weighted_df, blocks_df)
+
+
+def persist_dataframe(path_dir, df, filename, compression='gzip'):
+    os.makedirs(path_dir, exist_ok=True)
+    file_dir = os.path.join(path_dir, filename.lower())
+    df.to_csv(file_dir, index=False, compression=compression)
+    return file_dir
+
+
 def load_dataframes(path_dir):
+    # Pickled dataframes (see download.py --convert) are loaded instead of the
+    # CSV files when they are up to date
     filenames = [filename for filename in os.listdir(
         path_dir) if filename.endswith('.csv.gz')]
     dfs = dict()
 
     for filename in tqdm(filenames, desc="Loading dataframes"):
+        pickle_dir = path_dir + filename.split('.')[0] + '.pkl'
+        if os.path.exists(pickle_dir) and os.path.getmtime(pickle_dir) >= os.path.getmtime(path_dir + filename):
+            dfs[filename.split('.')[0]] = pd.read_pickle(pickle_dir)
+            continue
         df = pd.read_csv(path_dir + filename)
         if 'timestamp' in df.columns:
             df['timestamp'] = pd.to_datetime(df['timestamp'])
         dfs[filename.split('.')[0]] = df
     return dfs
 
+
+
+def get_etherscan_labels(url):
+    # Etherscan labels of the accounts, without the empty ones
+    etherscan_labels_df = pd.read_json(url, orient='index')
+    etherscan_labels_df = etherscan_labels_df.drop(
+        columns=['labels']).reset_index()
+    etherscan_labels_df.columns = ['address', 'label']
+    etherscan_labels_df['address'] = etherscan_labels_df['address'].str.lower()
+    return etherscan_labels_df.query('label != ""')
+
+
+def get_sybil_list_labels(url):
+    # Accounts verified in the Uniswap sybil list, by Twitter handle or name
+    json_data = requests.get(url).json()
+    sybil_data = list(filter(lambda item: 'twitter' in item[1], json_data.items()))
+    sybil_data_other = list(
+        filter(lambda item: 'other' in item[1], json_data.items()))
+
+    sybil_data = list(map(lambda item: {
+        "address": item[0].lower(),
+        "label": item[1]['twitter']['handle'],
+        "verified_at": item[1]['twitter']['timestamp']
+    }, sybil_data))
+
+    sybil_data += list(map(lambda item: {
+        "address": item[0].lower(),
+        "label": item[1]['other']['name'],
+        "verified_at": None
+    }, sybil_data_other))
+
+    sybil_list_df = pd.DataFrame(sybil_data)
+    sybil_list_df['verified_at'] = pd.to_datetime(
+        sybil_list_df['verified_at'], unit='ms').dt.date
+    return sybil_list_df
+
+
+def load_tally_delegates(file_dir):
+    # Delegates of a Tally delegates page saved as HTML
+    from bs4 import BeautifulSoup as bs
+    with open(file_dir) as f:
+        bs_data = bs(f, 'html.parser')
+    delegate_elements = bs_data.find_all(
+        'a', class_='chakra-link chakra-stack no-underline css-l6tukm')
+    # Iterate over each delegate element and extract the required fields
+    delegates = []
+
+    for element in delegate_elements:
+        label = element.find(
+            'span', class_='css-1baulvz').text if element.find('span', class_='css-1baulvz') else None
+        address = element['href'].split('/')[-1]
+        voting_power = element.find('p', class_='chakra-text css-6o3z7p').text if element.find(
+            'p', class_='chakra-text css-6o3z7p') else None
+        trusted_by = element.find('p', class_='chakra-text css-x44qgv').text if element.find(
+            'p', class_='chakra-text css-x44qgv') else None
+
+        delegate_info = {
+            'label': label,
+            'address': address.lower(),
+            'votin_power': voting_power,
+            'trusted_by':  int(re.sub(r'[^0-9\.]', '', trusted_by))
+        }
+
+        delegates.append(delegate_info)
+
+    # Converting the list to a Pandas dataframe
+    tally_labels_df = pd.DataFrame(delegates)
+    return tally_labels_df
+
+
+def drop_truncated_labels(tally_labels_df):
+    # Tally shortens the names that do not fit with '...'
+    mask = tally_labels_df.apply(lambda x: '...' not in x['label'], axis=1)
+    return tally_labels_df[mask].reset_index()
+
+
+def get_proposals_defeated(votes_weighted_df):
+    # Proposals defeated by the community
+    return votes_weighted_df.query('status == "defeated"').sort_values(by='proposalId', ascending=True)
+
+
+def get_proposals_created_timestamp(votes_weighted_df):
+    return votes_weighted_df[['proposalId', 'blockNumber', 'status', 'timestamp']].rename(
+        columns={'timestamp': 'proposal_created_timestamp'}).sort_values(by='proposal_created_timestamp')
+
+
+def get_monthly_proposals(proposals_created_timestamp_df):
+    # Number of proposals created each month
+    return proposals_created_timestamp_df.set_index(
+        'proposal_created_timestamp').resample('ME')['proposalId'].count()
+
+
+def get_votes_per_proposal(votes_df, proposals_defeated_df, min_votes=1e-3):
+    # Mean, median and total voting power of the votes cast on each proposal
+    # that was not defeated, ignoring the votes with less than min_votes
+    proposals_ids = proposals_defeated_df.proposalId
+    return votes_df.query(
+        "(proposalId not in @proposals_ids) and (votes >= @min_votes)"
+    ).groupby('proposalId').agg({'votes': ['mean', 'median', 'sum']})
+
+
+def get_proposal_margins(votes_weighted_df):
+    # Percentage of votes in favor, against and abstaining, and margin of
+    # victory of the defeated and executed proposals
+    margins_df = votes_weighted_df.set_index('proposalId').sort_index()[
+        ['supporter_in_favor_percentage', 'supporter_against_percentage',
+            'supporter_abstain_percentage', 'status']
+    ]
+    margins_df = margins_df.query(
+        'status == "defeated" or status == "executed"').copy()
+    margins_df['margin'] = margins_df['supporter_in_favor_percentage'] - \
+        margins_df['supporter_against_percentage']
+    return margins_df.rename(columns={'supporter_in_favor_percentage': 'in-favor',
+                                      'supporter_against_percentage': 'against',
+                                      'supporter_abstain_percentage': 'abstain'})
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'src')))
+
+from download import download_dataset, download_file  # noqa: E402
+
+content = os.urandom(300_000)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    # Serves server.files with support for Range requests, unless
+    # server.ignore_range is set, and counts the GET requests
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.n_requests += 1
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header and not self.server.ignore_range:
+            offset = int(range_header.replace('bytes=', '').rstrip('-'))
+            if offset >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data, status = data[offset:], 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    server.files = {'/file.bin': content}
+    server.ignore_range = False
+    server.n_requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_file(server, tmp_path):
+    file_dir = str(tmp_path / 'file.bin')
+    download_file(requests.Session(), server.url + '/file.bin', file_dir, size=len(content))
+    with open(file_dir, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(file_dir + '.part')
+
+
+@pytest.mark.parametrize('ignore_range', [False, True])
+def test_download_file_resumes_part_file(server, tmp_path, ignore_range):
+    server.ignore_range = ignore_range
+    file_dir = str(tmp_path / 'file.bin')
+    with open(file_dir + '.part', 'wb') as f:
+        f.write(content[:100_000])
+    download_file(requests.Session(), server.url + '/file.bin', file_dir, size=len(content))
+    with open(file_dir, 'rb') as f:
+        assert f.read() == content
+    assert server.n_requests == 1
+
+
+def test_download_file_restarts_longer_part_file(server, tmp_path):
+    file_dir = str(tmp_path / 'file.bin')
+    with open(file_dir + '.part', 'wb') as f:
+        f.write(os.urandom(len(content) + 10))
+    download_file(requests.Session(), server.url + '/file.bin', file_dir, size=len(content))
+    with open(file_dir, 'rb') as f:
+        assert f.read() == content
+
+
+@pytest.mark.parametrize('size', [len(content) - 1, len(content) + 1])
+def test_download_file_size_mismatch(server, tmp_path, size):
+    file_dir = str(tmp_path / 'file.bin')
+    with pytest.raises(ValueError, match='Size mismatch'):
+        download_file(requests.Session(), server.url + '/file.bin', file_dir, size=size, n_err=3)
+    assert server.n_requests == 3
+    assert not os.path.exists(file_dir)
+    assert not os.path.exists(file_dir + '.part')
+
+
+def test_download_file_not_found(server, tmp_path, monkeypatch):
+    monkeypatch.setattr('download.time.sleep', lambda seconds: None)
+    with pytest.raises(TimeoutError):
+        download_file(requests.Session(), server.url + '/missing.bin',
+                      str(tmp_path / 'missing.bin'), n_err=2)
+    assert server.n_requests == 2
+
+
+def test_download_dataset_records_manifest(server, tmp_path):
+    server.files['/blocks/blocks.csv'] = b'number,timestamp\n1,2020-01-01\n'
+    manifest = {'others': ['file.bin'], 'blocks': ['blocks.csv']}
+    with open(tmp_path / 'files.json', 'w') as f:
+        json.dump(manifest, f)
+
+    results, errors = download_dataset(str(tmp_path), base_url=server.url, max_workers=2)
+    assert not errors
+    assert sorted(result['status'] for result in results) == ['downloaded', 'downloaded']
+    with open(tmp_path / 'files.json') as f:
+        manifest = json.load(f)
+    assert manifest['others'][0] == {'name': 'file.bin', 'size': len(content),
+                                     'sha256': hashlib.sha256(content).hexdigest()}
+
+    # Recorded files are verified without downloading them again
+    n_requests = server.n_requests
+    results, errors = download_dataset(str(tmp_path), base_url=server.url, max_workers=2)
+    assert [result['status'] for result in results] == ['verified', 'verified']
+    assert server.n_requests == n_requests
+
+    # A corrupted file is downloaded again
+    with open(tmp_path / 'file.bin', 'r+b') as f:
+        f.write(b'\0' * 10)
+    results, errors = download_dataset(str(tmp_path), base_url=server.url, max_workers=2)
+    assert not errors
+    with open(tmp_path / 'file.bin', 'rb') as f:
+        assert f.read() == content
@@ -0,0 +1,121 @@
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'src')))
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'benchmarks')))
+
+from follower import ChainFollower  # noqa: E402
+from mock_node import MockNode, governor_abi, governor_address, token_abi, token_address  # noqa: E402
+from rpc_pool import get_w3  # noqa: E402
+
+chain_kwargs = {'head': 1000, 'txs_per_block': 1, 'votes_per_block': 2,
+                'proposals_per_block': 0.05, 'transfers_per_block': 0}
+
+
+def control(url, method, *params):
+    # Move the head or reorg the chain of a mock node
+    rq = requests.post(url, json={'jsonrpc': '2.0', 'id': 1, 'method': method,
+                                  'params': list(params)})
+    assert rq.json()['result'] is True
+
+
+def get_contracts(w3):
+    return {'mock-governor': w3.eth.contract(address=governor_address, abi=governor_abi),
+            'mock-token': w3.eth.contract(address=token_address, abi=token_abi)}
+
+
+@pytest.fixture
+def node_url():
+    with MockNode(**chain_kwargs) as node:
+        yield node.url
+
+
+@pytest.fixture
+def follow(node_url):
+    def follow(start_block=900, confirmations=12, w3s=None):
+        w3s = w3s or [get_w3(node_url)]
+        reorgs = list()
+        follower = ChainFollower(w3s, get_contracts(w3s[0]), start_block=start_block,
+                                 confirmations=confirmations, max_range=40,
+                                 on_reorg=lambda block_number, removed: reorgs.append((block_number, len(removed))))
+        return follower, reorgs
+    return follow
+
+
+def get_tallies(state):
+    return {key: dict(tally) for key, tally in state.tallies.items()}
+
+
+def test_follows_new_blocks_and_confirms(node_url, follow):
+    follower, reorgs = follow()
+    events = follower.poll()
+    assert len(events) > 0
+    assert follower.last_block == 1000
+    assert follower.confirmed_block == 988
+    assert all(event['blockNumber'] > 988 for _, event in follower.pending)
+
+    control(node_url, 'mock_setHead', 1030)
+    follower.poll()
+    assert follower.last_block == 1030
+    assert follower.confirmed_block == 1018
+    assert min(follower.block_hashes) == 1018
+    assert reorgs == list()
+
+    # The confirmed state holds the events up to the confirmed block only
+    confirmed, _ = follow(confirmations=0)
+    control(node_url, 'mock_setHead', 1018)
+    confirmed.poll()
+    assert get_tallies(follower.confirmed) == get_tallies(confirmed.live)
+
+
+def test_reorg_is_rolled_back(node_url, follow):
+    follower, reorgs = follow()
+    follower.poll()
+    control(node_url, 'mock_setHead', 1010)
+    follower.poll()
+    before = get_tallies(follower.live)
+
+    control(node_url, 'mock_reorg', 1005)
+    follower.poll()
+    assert len(reorgs) == 1
+    block_number, n_removed = reorgs[0]
+    assert 995 <= block_number < 1005
+    assert n_removed > 0
+    assert follower.last_block == 1010
+    assert get_tallies(follower.live) != before
+
+    # Same tallies as a follower that only saw the new branch
+    fresh, _ = follow()
+    fresh.poll()
+    assert get_tallies(follower.live) == get_tallies(fresh.live)
+    assert follower.block_hashes[1010] == fresh.block_hashes[1010]
+
+
+def test_deep_reorg_raises(node_url, follow):
+    follower, _ = follow()
+    follower.poll()
+    control(node_url, 'mock_reorg', 950)
+    with pytest.raises(ValueError):
+        follower.poll()
+
+
+def test_lagging_node_is_skipped(node_url, follow):
+    with MockNode(**dict(chain_kwargs, head=990)) as lagging:
+        follower, reorgs = follow(w3s=[get_w3(node_url), get_w3(lagging.url)])
+        follower.poll()
+        before = get_tallies(follower.live)
+        follower.next_node()
+        assert follower.poll() == list()
+        assert reorgs == list()
+        assert follower.last_block == 1000
+        assert get_tallies(follower.live) == before
+        # The follower moved back to the node that is up to date
+        assert follower.node == 0
+        control(node_url, 'mock_setHead', 1010)
+        assert len(follower.poll()) > 0
+        assert reorgs == list()
@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'src')))
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'benchmarks')))
+
+import pipeline  # noqa: E402
+from mock_node import MockNode, governor_abi, governor_address, token_abi, token_address  # noqa: E402
+
+settings = [{'contract_name': 'mock-governor', 'contract_address': governor_address, 'abi_address': None,
+             'start': 100, 'end': pipeline.block_max_ethereum, 'events': None},
+            {'contract_name': 'mock-token', 'contract_address': token_address, 'abi_address': None,
+             'start': 100, 'end': pipeline.block_max_ethereum, 'events': ['Transfer']}]
+protocols = {'mock': {'governors': {'mock-governor': None},
+                      'token': 'mock-token', 'title_fixes': {}}}
+abis = {'mock-governor': governor_abi, 'mock-token': token_abi}
+
+
+@pytest.fixture(scope='module')
+def node_url():
+    with MockNode(head=2000, proposals_per_block=0.01, transfers_per_block=1, txs_per_block=1) as node:
+        yield node.url
+
+
+@pytest.fixture
+def build(node_url, tmp_path, monkeypatch):
+    # The ABIs come from the mock node instead of Etherscan
+    def get_contract(self, contract_setting):
+        return self.get_w3().eth.contract(address=contract_setting['contract_address'],
+                                          abi=abis[contract_setting['contract_name']])
+
+    monkeypatch.setattr(pipeline.ContractLoader, 'get_contract', get_contract)
+    blocks_file = str(tmp_path / 'blocks.csv.gz')
+    pd.DataFrame({'number': range(0, 1400),
+                  'timestamp': pd.to_datetime(1_438_269_973 + 12 * pd.Series(range(0, 1400)), unit='s')}).to_csv(
+        blocks_file, index=False, compression='gzip')
+
+    def build(end_block):
+        return pipeline.build_governance_pipeline(str(tmp_path / 'data'), str(tmp_path / 'cache'), [node_url],
+                                                  blocks_file, end_block=end_block, partition_size=500,
+                                                  max_workers=4, settings=settings, protocols=protocols,
+                                                  labels=dict())
+    return build
+
+
+def test_partitions_do_not_overlap():
+    assert pipeline.get_partitions(100, 1450, 500) == [
+        (100, 499), (500, 999), (1000, 1450)]
+    assert pipeline.get_partitions(1400, 1399, 500) == list()
+
+
+def test_rerun_is_a_no_op(build, tmp_path):
+    computed = build(1450).run()
+    assert 'events/mock-governor/1000-1450' in computed
+    assert 'missing-blocks/1400-1450' in computed
+    assert os.path.exists(tmp_path / 'data' / 'mock' / 'votes_weighted_df.csv.gz')
+    assert os.path.exists(tmp_path / 'data' / 'eda' / 'mock' / 'votes_per_proposal_df.csv.gz')
+    assert build(1450).run() == list()
+
+
+def test_extension_recomputes_last_and_new_partitions(build, tmp_path):
+    build(1450).run()
+    computed = build(1700).run()
+    partitions = {name for name in computed if name.startswith(
+        ('events/', 'parsed/', 'missing-blocks/'))}
+    # The blocks file ends at block 1399
+    assert partitions == {f'{stage}/{partition}'
+                          for stage in ['events/mock-governor', 'events/mock-token',
+                                        'parsed/mock-governor', 'parsed/mock-token']
+                          for partition in ['1000-1499', '1500-1700']} | {
+        'missing-blocks/1400-1499', 'missing-blocks/1500-1700'}
+    assert {'tables/mock-governor', 'tables/mock-token', 'missing-blocks',
+            'datasets/mock', 'csv/mock', 'eda/mock', 'csv/eda/mock'} <= set(computed)
+
+    votes_df = pd.read_csv(tmp_path / 'data' / 'mock' / 'votes_df.csv.gz')
+    assert votes_df.blockNumber.between(100, 1700).all()
+    assert votes_df.blockNumber.max() > 1500
+    # Every vote has the timestamp of its block, fetched from the node past the blocks file
+    assert votes_df.timestamp.notna().all()
+    assert not votes_df.duplicated(subset=['transactionHash', 'logIndex']).any()
@@ -0,0 +1,210 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from web3 import Web3
+from web3.exceptions import Web3RPCError
+
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'src')))
+
+from rpc_pool import RetriesExhaustedError, RPCPool  # noqa: E402
+
+
+class NodeHandler(BaseHTTPRequestHandler):
+    # Answers eth_blockNumber with server.block_number. server.responses is a
+    # list of (status, error) pairs answered first, one per request, and
+    # server.delays a list of seconds to sleep before answering. Servers
+    # sharing server.slow_first answer the first request they get together
+    # after slow_first['delay'] seconds
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.n_requests += 1
+            status, error = self.server.responses.pop(
+                0) if self.server.responses else (200, None)
+            delay = self.server.delays.pop(0) if self.server.delays else 0
+        slow_first = self.server.slow_first
+        if slow_first is not None:
+            with slow_first['lock']:
+                if slow_first['n_requests'] == 0:
+                    delay = slow_first['delay']
+                slow_first['n_requests'] += 1
+        time.sleep(delay)
+        if self.server.down:
+            status, error = 503, {'code': -32603, 'message': 'down'}
+        response = {'jsonrpc': '2.0', 'id': request['id']}
+        if error is None:
+            response['result'] = hex(self.server.block_number)
+        else:
+            response['error'] = error
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nodes():
+    servers = list()
+
+    def start(block_number=100):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), NodeHandler)
+        server.daemon_threads = True
+        server.lock = threading.Lock()
+        server.block_number = block_number
+        server.responses = list()
+        server.delays = list()
+        server.down = False
+        server.slow_first = None
+        server.n_requests = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_rate_limit_backs_off_and_succeeds(nodes):
+    node = nodes()
+    node.responses = [(429, {'code': 429, 'message': 'too many requests'})] * 2 + \
+        [(200, {'code': -32005, 'message': 'rate limit exceeded'})]
+    pool = RPCPool([node.url], backoff_base=0.05)
+    start = time.monotonic()
+    assert Web3(pool).eth.block_number == 100
+    assert node.n_requests == 4
+    # Backoffs of up to 0.05, 0.1 and 0.2 seconds
+    assert time.monotonic() - start < 1
+    assert pool.endpoints[0].failures == 0
+
+
+def test_rate_limit_retries_are_bounded(nodes):
+    node = nodes()
+    node.responses = [(429, None)] * 10
+    pool = RPCPool([node.url], max_retries=3, backoff_base=0.01)
+    with pytest.raises(RetriesExhaustedError):
+        Web3(pool).eth.block_number
+    assert node.n_requests == 3
+
+
+def test_rate_limits_do_not_open_the_circuit(nodes):
+    node = nodes()
+    node.responses = [(429, None)] * 5
+    pool = RPCPool([node.url], failure_threshold=2, backoff_base=0.01)
+    assert Web3(pool).eth.block_number == 100
+    assert node.n_requests == 6
+    assert pool.endpoints[0].open_until == 0.0
+
+
+def test_log_limit_error_is_not_retried(nodes):
+    node = nodes()
+    node.responses = [
+        (200, {'code': -32005, 'message': 'query returned more than 10000 results'})]
+    pool = RPCPool([node.url], backoff_base=0.01)
+    with pytest.raises(Web3RPCError, match='more than 10000 results'):
+        Web3(pool).eth.block_number
+    assert node.n_requests == 1
+    assert pool.endpoints[0].failures == 0
+
+
+def test_dead_endpoint_trips_and_is_probed(nodes):
+    node = nodes()
+    node.down = True
+    pool = RPCPool([node.url], failure_threshold=2, cooldown=0.5, max_retries=4,
+                   backoff_base=0.01)
+    w3 = Web3(pool)
+    endpoint = pool.endpoints[0]
+    # Two failures open the circuit and the other attempts find no endpoint
+    with pytest.raises(RetriesExhaustedError, match='unavailable'):
+        w3.eth.block_number
+    assert node.n_requests == 2
+    assert endpoint.open_until > time.monotonic()
+
+    # While the circuit is open the endpoint gets no requests
+    with pytest.raises(RetriesExhaustedError):
+        w3.eth.block_number
+    assert node.n_requests == 2
+
+    # After the cooldown a single probe fails and opens the circuit again
+    time.sleep(0.5)
+    with pytest.raises(RetriesExhaustedError):
+        w3.eth.block_number
+    assert node.n_requests == 3
+    assert endpoint.open_until > time.monotonic()
+
+    # Once the node is back the next probe closes the circuit
+    node.down = False
+    time.sleep(0.5)
+    assert w3.eth.block_number == 100
+    assert node.n_requests == 4
+    assert endpoint.open_until == 0.0
+    assert endpoint.failures == 0
+
+
+def test_requests_avoid_open_circuit(nodes):
+    dead, alive = nodes(), nodes()
+    dead.down = True
+    pool = RPCPool([dead.url, alive.url], failure_threshold=1, cooldown=60,
+                   backoff_base=0.01, hedge_min_samples=10**6)
+    w3 = Web3(pool)
+    # Requests sent to the dead node are retried on the other one
+    for _ in range(20):
+        assert w3.eth.block_number == 100
+    assert dead.n_requests <= 1
+    assert alive.n_requests == 20
+
+
+def test_slow_request_is_hedged(nodes):
+    first, second = nodes(), nodes()
+    # Whichever node gets the first request is slow to answer it
+    first.slow_first = second.slow_first = {
+        'lock': threading.Lock(), 'n_requests': 0, 'delay': 1}
+    pool = RPCPool([first.url, second.url], hedge_delay=0.05)
+    start = time.monotonic()
+    assert Web3(pool).eth.block_number == 100
+    assert time.monotonic() - start < 0.9
+    assert first.n_requests == 1
+    assert second.n_requests == 1
+
+
+def test_hedging_waits_for_latency_samples(nodes):
+    first, second = nodes(), nodes()
+    pool = RPCPool([first.url, second.url], hedge_min_samples=5)
+    w3 = Web3(pool)
+    for _ in range(4):
+        w3.eth.block_number
+    assert pool.get_hedge_delay('eth_blockNumber') is None
+    w3.eth.block_number
+    assert pool.get_hedge_delay('eth_blockNumber') is not None
+    assert pool.get_hedge_delay('eth_getLogs') is None
+
+
+def test_faster_endpoint_gets_more_requests(nodes):
+    slow, fast = nodes(), nodes()
+    slow.delays = [0.2] * 1000
+    pool = RPCPool([slow.url, fast.url], hedge_min_samples=10**6)
+    w3 = Web3(pool)
+    # Both endpoints start with the same latency estimate
+    for _ in range(40):
+        w3.eth.block_number
+    slow.n_requests = fast.n_requests = 0
+    for _ in range(100):
+        w3.eth.block_number
+    assert pool.endpoints[0].latency > 2 * pool.endpoints[1].latency
+    assert fast.n_requests > 2 * slow.n_requests
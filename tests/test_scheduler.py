@@ -0,0 +1,100 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.realpath(os.path.join(
+    os.path.dirname(__file__), '..', 'src')))
+
+from scheduler import get_all_events_from_contracts  # noqa: E402
+
+
+class FakeEvent:
+    # Stands for contract.events[event_name]: one event per block
+    def __init__(self, contract_name, event_name):
+        self.contract_name = contract_name
+        self.event_name = event_name
+
+    def get_logs(self, from_block, to_block):
+        time.sleep(0.001)
+        return [{'contract': self.contract_name, 'event': self.event_name, 'blockNumber': block_number}
+                for block_number in range(from_block, to_block + 1)]
+
+
+class FakeEvents(dict):
+    def __iter__(self):
+        return iter(self.values())
+
+
+class FakeContract:
+    def __init__(self, contract_name, event_names):
+        self.events = FakeEvents({event_name: FakeEvent(contract_name, event_name)
+                                  for event_name in event_names})
+
+
+@pytest.fixture
+def crawl():
+    contracts = {'x-governor': FakeContract('x-governor', ['VoteCast', 'ProposalCreated']),
+                 'x-token': FakeContract('x-token', ['Transfer', 'DelegateChanged']),
+                 'y-token': FakeContract('y-token', ['Transfer'])}
+    settings = [{'contract_name': 'x-governor', 'start': 0, 'end': 999, 'events': None, 'batch_size': 100},
+                {'contract_name': 'x-token', 'start': 500,
+                    'end': 1500, 'events': None, 'batch_size': 10},
+                {'contract_name': 'y-token', 'start': 0, 'end': 799, 'events': ['Transfer'], 'batch_size': 10}]
+    return contracts, settings
+
+
+def check_events(contract_events, start, end):
+    for event_name, events in contract_events.items():
+        assert [event['blockNumber'] for event in events] == list(range(start, end + 1))
+        assert {event['event'] for event in events} == {event_name}
+
+
+def test_events_are_merged_in_block_order(crawl):
+    contracts, settings = crawl
+    events = get_all_events_from_contracts(contracts, settings, max_workers=8)
+    assert set(events) == {'x-governor', 'x-token', 'y-token'}
+    check_events(events['x-governor'], 0, 999)
+    check_events(events['x-token'], 500, 1500)
+    assert list(events['y-token']) == ['Transfer']
+
+
+def test_callback_gets_spilled_contracts_one_at_a_time(crawl, tmp_path):
+    contracts, settings = crawl
+    spill_dir = str(tmp_path / 'spill')
+    ranges = {setting['contract_name']: (setting['start'], setting['end'])
+              for setting in settings}
+    active = list()
+    saved = dict()
+    lock = threading.Lock()
+
+    def save(contract_name, contract_events):
+        with lock:
+            active.append(contract_name)
+            assert len(active) == 1
+        # Every batch of the other contracts stays on disk meanwhile
+        time.sleep(0.01)
+        check_events(contract_events, *ranges[contract_name])
+        saved[contract_name] = {event_name: len(events)
+                                for event_name, events in contract_events.items()}
+        with lock:
+            active.remove(contract_name)
+
+    counts = get_all_events_from_contracts(contracts, settings, max_workers=8, callback=save,
+                                           spill_dir=spill_dir)
+    assert counts == saved
+    assert counts['x-token'] == {'Transfer': 1001, 'DelegateChanged': 1001}
+    assert os.listdir(spill_dir) == []
+
+
+def test_callback_errors_are_raised(crawl):
+    contracts, settings = crawl
+
+    def save(contract_name, contract_events):
+        raise OSError('disk full')
+
+    with pytest.raises(OSError, match='disk full'):
+        get_all_events_from_contracts(
+            contracts, settings, max_workers=4, callback=save)